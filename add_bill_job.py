@@ -1,15 +1,25 @@
 #!/usr/bin/env python3
 """
 Script to queue a bill generation job
-Usage: python add_bill_job.py [user_id] [num_reps]
+Usage: python add_bill_job.py [user_id] [num_reps] [bill_id|-] [priority] [deadline_seconds]
+Priority is a number (higher runs first) or one of batch, normal, interactive.
 """
 import sys
 import mysql.connector
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
+from wakeup import notify_worker
 
-def add_bill_job(user_id=1, num_reps=42):
-    """Add a bill generation job to the queue"""
+# Named date_job.priority levels; the column defaults to batch
+PRIORITIES = {"batch": 0, "normal": 5, "interactive": 10}
+
+def add_bill_job(user_id=1, num_reps=42, bill_id=None, priority=PRIORITIES["interactive"], deadline_seconds=None):
+    """Add a bill generation job to the queue (scoped to one bill when bill_id is given)
+    
+    Jobs queued here follow a user's edit, so they default to interactive
+    priority. With deadline_seconds, the worker claims the job ahead of
+    everything else once its deadline is close.
+    """
     try:
         # Connect to database
         db = mysql.connector.connect(
@@ -21,21 +31,27 @@ def add_bill_job(user_id=1, num_reps=42):
         cursor = db.cursor()
         
         # Prepare job parameters
-        params = {}
+        params = {"user_id": user_id, "num_reps": num_reps}
+        if bill_id is not None:
+            params["bill_id"] = bill_id
         
         # Create the command for the worker
         command = f"generate_bill_dates:{json.dumps(params)}"
         
-        # Insert job into queue
-        query = """INSERT INTO date_job (command, status, created_at) 
-                   VALUES (%s, %s, %s)"""
+        # Insert job into queue; user_id lets workers route it by user (see worker.py)
+        query = """INSERT INTO date_job (command, status, created_at, user_id, priority, deadline) 
+                   VALUES (%s, %s, %s, %s, %s, %s)"""
         
-        cursor.execute(query, (command, 'pending', datetime.now()))
+        now = datetime.now()
+        deadline = now + timedelta(seconds=deadline_seconds) if deadline_seconds else None
+        cursor.execute(query, (command, 'pending', now, user_id, priority, deadline))
         db.commit()
+        notify_worker()
         
         job_id = cursor.lastrowid
         print(f"Bill generation job added to queue with ID: {job_id}")
-        print(f"Parameters: User ID = {user_id}, Repetitions = {num_reps}")
+        print(f"Parameters: User ID = {user_id}, Repetitions = {num_reps}, Bill ID = {bill_id}, "
+              f"Priority = {priority}, Deadline = {deadline}")
         
         cursor.close()
         db.close()
@@ -49,6 +65,10 @@ def add_bill_job(user_id=1, num_reps=42):
 if __name__ == "__main__":
     user_id = int(sys.argv[1]) if len(sys.argv) > 1 else 1
     num_reps = int(sys.argv[2]) if len(sys.argv) > 2 else 42
+    bill_id = int(sys.argv[3]) if len(sys.argv) > 3 and sys.argv[3] != "-" else None
+    priority = sys.argv[4] if len(sys.argv) > 4 else "interactive"
+    priority = PRIORITIES[priority] if priority in PRIORITIES else int(priority)
+    deadline_seconds = int(sys.argv[5]) if len(sys.argv) > 5 else None
     
     print(f"Adding bill generation job for user {user_id} with {num_reps} repetitions...")
-    add_bill_job(user_id, num_reps)
+    add_bill_job(user_id, num_reps, bill_id, priority, deadline_seconds)
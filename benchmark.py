@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Benchmark bill date generation against an in-memory SQLite stand-in for MySQL
+Usage: python benchmark.py [--users 50] [--bills 40] [--num-reps 42] [--batch-size 1000]
+                           [--mix "Once Per Month=3,Every 2 Weeks=1"] [--latency-ms 0.2]
+                           [--all-users] [--pipelined] [--horizon-days 120]
+                           [--output benchmark_results.json]
+
+Each user is one job (delete_old_dates + set_pay_period + generate), run
+through the real Bills class. Results are written as JSON so runs from
+different commits can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import sqlite3
+import subprocess
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from bills import Bills
+from bill_rule import Frequency
+from log_setup import setup_logging
+
+SCHEMA = [
+    """CREATE TABLE vnd_bills (
+           vnd_id INTEGER PRIMARY KEY,
+           vnd_user_id INTEGER,
+           vnd_bill TEXT,
+           amount REAL,
+           vnd_frequency TEXT,
+           vnd_frequency_value TEXT,
+           vnd_frequency_type TEXT,
+           is_future INTEGER DEFAULT 0,
+           is_heavy INTEGER DEFAULT 0,
+           start_date TEXT,
+           end_date TEXT
+       )""",
+    "CREATE INDEX idx_bills_user ON vnd_bills (vnd_user_id)",
+    """CREATE TABLE vnd_bill_dates (
+           vnd_id INTEGER PRIMARY KEY,
+           vnd_bill_desc TEXT,
+           vnd_user_id INTEGER,
+           vnd_amount REAL,
+           vnd_date TEXT,
+           vnd_is_future INTEGER,
+           is_heavy INTEGER,
+           vnd_frequency TEXT,
+           vnd_frequency_type TEXT,
+           vnd_bill_id INTEGER,
+           UNIQUE (vnd_user_id, vnd_bill_desc, vnd_date)
+       )""",
+    """CREATE TABLE vnd_bill_dates_version (
+           vnd_user_id INTEGER PRIMARY KEY,
+           version INTEGER NOT NULL DEFAULT 0
+       )""",
+]
+
+# MySQL-only syntax used by Bills -> SQLite equivalent
+TRANSLATIONS = [
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\bTRUNCATE\s+(\w+)"), r"DELETE FROM \1"),
+    (re.compile(r"\bINSERT IGNORE\b"), "INSERT OR IGNORE"),
+    (re.compile(r"\bON DUPLICATE KEY UPDATE\b"), "ON CONFLICT DO UPDATE SET"),
+]
+
+FIXED_TODAY = "2024-01-10 09:00:00"
+
+
+class StandInConnection:
+    """Just enough of a mysql.connector connection for Bills, backed by SQLite"""
+
+    def __init__(self, latency=0.0):
+        # Pipelined runs read and write from different threads
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.latency = latency
+        self.queries = 0
+        self.query_time = 0.0
+
+    def cursor(self, dictionary=False, buffered=True):
+        return StandInCursor(self, dictionary)
+
+    def round_trip(self, func, *args):
+        """Run a statement, counting it and adding the simulated network latency"""
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        result = func(*args)
+        self.queries += 1
+        self.query_time += time.perf_counter() - start
+        return result
+
+    def commit(self):
+        self.round_trip(self.conn.commit)
+
+    def close(self):
+        pass
+
+
+class StandInCursor:
+    def __init__(self, connection, dictionary):
+        self.connection = connection
+        self.dictionary = dictionary
+        self.cursor = connection.conn.cursor()
+        self.rowcount = -1
+
+    @staticmethod
+    def translate(query):
+        for pattern, replacement in TRANSLATIONS:
+            query = pattern.sub(replacement, query)
+        return query
+
+    def execute(self, query, params=()):
+        self.connection.round_trip(self.cursor.execute, self.translate(query), tuple(params))
+        self.rowcount = self.cursor.rowcount
+
+    def executemany(self, query, seq_params):
+        self.connection.round_trip(self.cursor.executemany, self.translate(query), list(seq_params))
+        self.rowcount = self.cursor.rowcount
+
+    def _row(self, row):
+        if row is None:
+            return None
+        return dict(row) if self.dictionary else tuple(row)
+
+    def fetchone(self):
+        return self._row(self.cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self.cursor.fetchall()]
+
+    def __iter__(self):
+        for row in self.cursor:
+            yield self._row(row)
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def close(self):
+        self.cursor.close()
+
+
+def parse_mix(mix):
+    """Parse 'Once Per Month=3,Every 2 Weeks=1' into {frequency: weight}"""
+    if not mix:
+        return {frequency.label: 1 for frequency in Frequency}
+    weights = {}
+    for part in mix.split(","):
+        frequency, _, weight = part.partition("=")
+        try:
+            frequency = Frequency.parse(frequency.strip())
+        except ValueError as e:
+            raise SystemExit(f"Bad --mix: {e}")
+        weights[frequency.label] = float(weight or 1)
+    return weights
+
+
+def synthetic_bill(rng, user_id, index, frequency):
+    """Build one vnd_bills row with a plausible value for its frequency"""
+    kind = Frequency.parse(frequency).kind
+    start = date(2023, 1, 1) + timedelta(days=rng.randrange(365))
+    if kind == "once":
+        freq_type, value = "Date", (start + timedelta(days=400)).isoformat()
+    elif kind == "once_per_month":
+        freq_type, value = "Day of Month", str(rng.randint(1, 31))
+    elif kind == "once_per_week":
+        freq_type, value = "Day of Week", str(rng.randint(0, 6))
+    else:
+        freq_type, value = "Starting From", start.isoformat()
+    end_date = (start + timedelta(days=rng.randrange(365, 1500))).isoformat() if rng.random() < 0.2 else None
+    return (user_id, f"Bill {index}", round(rng.uniform(5, 500), 2), frequency, value, freq_type,
+            int(rng.random() < 0.1), int(rng.random() < 0.1), None, end_date)
+
+
+def build_dataset(connection, users, bills_per_user, mix, seed):
+    """Fill vnd_bills with users * bills_per_user synthetic rows"""
+    rng = random.Random(seed)
+    frequencies = list(mix)
+    weights = [mix[frequency] for frequency in frequencies]
+    rows = []
+    for user_id in range(1, users + 1):
+        for index in range(bills_per_user):
+            frequency = rng.choices(frequencies, weights)[0]
+            rows.append(synthetic_bill(rng, user_id, index, frequency))
+    connection.conn.executemany(
+        """INSERT INTO vnd_bills (vnd_user_id, vnd_bill, amount, vnd_frequency, vnd_frequency_value,
+                                  vnd_frequency_type, is_future, is_heavy, start_date, end_date)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+    connection.conn.commit()
+
+
+def run_jobs(connection, users, num_reps, batch_size, all_users, pipelined=False, horizon_days=None):
+    """Run one generation job per user (or a single all-users job), returning per-job seconds"""
+    latencies = []
+    jobs = [None] if all_users else range(1, users + 1)
+    for user_id in jobs:
+        start = time.perf_counter()
+        bill = Bills(num_reps, connection, batch_size, horizon_days=horizon_days)
+        bill.set_pay_period(today=FIXED_TODAY)
+        if all_users:
+            bill.delete_old_dates()
+        else:
+            bill.delete_old_dates(user_id=user_id)
+        if pipelined:
+            bill.generate_pipelined(connection, user_id)
+        elif all_users:
+            bill.generate_all_users(connection)
+        else:
+            bill.generate_bill_dates_by_user_id(user_id)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    # Same queued logging as the worker, with the output discarded
+    setup_logging(stream=open(os.devnull, "w"))
+    parser = argparse.ArgumentParser(description="Benchmark bill date generation")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--bills", type=int, default=40, help="bills per user")
+    parser.add_argument("--num-reps", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=1000, help="0 for per-row check + insert")
+    parser.add_argument("--mix", default="", help="frequency weights, e.g. 'Once Per Month=3,Every 2 Weeks=1'")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated round-trip latency per query")
+    parser.add_argument("--all-users", action="store_true", help="run one generate_all_users job")
+    parser.add_argument("--pipelined", action="store_true", help="use the threaded read/compute/write pipeline")
+    parser.add_argument("--horizon-days", type=int, default=None, help="generate up to a date horizon instead of num_reps")
+    parser.add_argument("--tracemalloc", action="store_true", help="measure Python heap peak (slower)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    connection = StandInConnection(args.latency_ms / 1000)
+    build_dataset(connection, args.users, args.bills, parse_mix(args.mix), args.seed)
+    connection.queries = 0
+    connection.query_time = 0.0
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    latencies = run_jobs(connection, args.users, args.num_reps, args.batch_size, args.all_users,
+                         args.pipelined, args.horizon_days)
+    elapsed = time.perf_counter() - started
+    heap_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    rows = connection.conn.execute("SELECT COUNT(*) FROM vnd_bill_dates").fetchone()[0]
+    latencies_ms = np.array(latencies) * 1000
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "jobs": len(latencies),
+        "rows": rows,
+        "elapsed_seconds": round(elapsed, 4),
+        "dates_per_second": round(rows / elapsed, 1) if elapsed else None,
+        "queries_per_job": round(connection.queries / len(latencies), 1),
+        "query_seconds": round(connection.query_time, 4),
+        "job_latency_ms": {
+            "p50": round(float(np.percentile(latencies_ms, 50)), 3),
+            "p99": round(float(np.percentile(latencies_ms, 99)), 3),
+            "max": round(float(latencies_ms.max()), 3),
+        },
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_heap_bytes": heap_peak,
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
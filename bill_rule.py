@@ -0,0 +1,188 @@
+"""
+Compiled bill rules.
+
+A BillRule is built once from a vnd_bills row. The frequency string
+becomes a Frequency member, and the frequency value and the start/end
+dates are parsed and validated up front. Generating occurrences then
+involves no string handling. RuleCache keeps compiled rules between jobs
+in the long-running worker.
+"""
+from collections import OrderedDict
+from enum import Enum
+
+import recurrence
+
+# Most compiled rules kept by a RuleCache before the least recently used are dropped
+MAX_CACHED_RULES = 100000
+
+# vnd_bills columns that determine a rule; used as the cache key
+RULE_FIELDS = ("vnd_user_id", "vnd_bill", "amount", "vnd_frequency", "vnd_frequency_value",
+               "vnd_frequency_type", "is_future", "is_heavy", "start_date", "end_date")
+
+
+class Frequency(Enum):
+    ONCE = ("Once", "once", None)
+    ONCE_PER_MONTH = ("Once Per Month", "once_per_month", None)
+    EVERY_3_MONTHS = ("Every 3 Months", "every_x_months", 3)
+    EVERY_1_MONTH = ("Every 1 Month", "every_x_months", 1)
+    ONCE_PER_WEEK = ("Once Per Week", "once_per_week", None)
+    EVERY_2_WEEKS = ("Every 2 Weeks", "every_x_weeks", 2)
+    EVERY_1_WEEK = ("Every 1 Week", "every_x_weeks", 1)
+    EVERY_4_WEEKS = ("Every 4 Weeks", "every_x_weeks", 4)
+
+    def __init__(self, label, kind, step):
+        self.label = label
+        self.kind = kind
+        # Months for every_x_months, weeks for every_x_weeks
+        self.step = step
+
+    @property
+    def frequency_type(self):
+        """vnd_frequency_type this frequency expects (None: any type)"""
+        return FREQUENCY_TYPES.get(self.kind)
+
+    @classmethod
+    def parse(cls, label):
+        try:
+            return _BY_LABEL[label]
+        except KeyError:
+            raise ValueError(f"Unknown frequency type: {label}")
+
+
+# Other vnd_frequency_type values generate nothing, as in the original PHP
+FREQUENCY_TYPES = {
+    "once_per_month": "Day of Month",
+    "every_x_months": "Starting From",
+    "once_per_week": "Day of Week",
+    "every_x_weeks": "Starting From",
+}
+
+_BY_LABEL = {frequency.label: frequency for frequency in Frequency}
+
+
+class BillRule:
+    __slots__ = ("user_id", "bill_desc", "amount", "frequency", "frequency_type", "value",
+                 "start_date", "end_date", "is_future", "is_heavy", "active")
+
+    def __init__(self, user_id, bill_desc, amount, frequency, frequency_type, value,
+                 start_date=None, end_date=None, is_future=0, is_heavy=0):
+        self.user_id = user_id
+        self.bill_desc = bill_desc
+        self.amount = amount
+        self.frequency = frequency
+        self.frequency_type = frequency_type
+        self.value = value
+        self.start_date = start_date
+        self.end_date = end_date
+        self.is_future = is_future
+        self.is_heavy = is_heavy
+        expected_type = frequency.frequency_type
+        self.active = expected_type is None or frequency_type == expected_type
+
+    @classmethod
+    def from_row(cls, row):
+        """Compile a vnd_bills row, raising ValueError if it can't generate dates"""
+        frequency = Frequency.parse(row['vnd_frequency'])
+        frequency_type = row['vnd_frequency_type']
+        raw_value = row['vnd_frequency_value']
+        start_date = end_date = None
+
+        value = None
+        kind = frequency.kind
+        if kind == "once":
+            value = recurrence.to_day(raw_value)
+        elif frequency_type == FREQUENCY_TYPES[kind]:
+            if kind == "once_per_month":
+                value = recurrence.parse_int_value(raw_value, 1, 31, "day of month")
+                start_date = recurrence.to_day(row.get('start_date'))
+                end_date = recurrence.to_day(row.get('end_date'))
+            elif kind == "once_per_week":
+                value = recurrence.parse_int_value(raw_value, 0, 6, "day of week")
+            else:
+                value = recurrence.parse_start_value(raw_value)
+
+        return cls(row.get('vnd_user_id'), row['vnd_bill'], row['amount'], frequency,
+                   frequency_type, value, start_date, end_date,
+                   row.get('is_future', 0), row.get('is_heavy', 0))
+
+    def _step_days(self):
+        return self.frequency.step * (30 if self.frequency.kind == "every_x_months" else 7)
+
+    def first_rep(self, anchor):
+        """Index of a 'Starting From' rule's first repetition on or after anchor (1 for other rules)"""
+        if self.frequency.kind not in ("every_x_months", "every_x_weeks") or not self.active:
+            return 1
+        days = int((recurrence.to_anchor(anchor) - self.value).astype(int))
+        return max(-(-days // self._step_days()), 1)
+
+    def reps_until(self, anchor, end):
+        """Smallest num_reps whose occurrences from first_rep(anchor) reach end (a datetime64[D])"""
+        kind = self.frequency.kind
+        if kind == "once" or not self.active:
+            return 1
+        if kind == "once_per_month":
+            months = end.astype("datetime64[M]") - recurrence.to_anchor(anchor).astype("datetime64[M]")
+            return max(int(months) + 1, 1)
+        if kind == "once_per_week":
+            return max(int((end - recurrence.to_anchor(anchor)).astype(int)) // 7 + 1, 1)
+        step = self._step_days()
+        first_day = self.value + step * self.first_rep(anchor)
+        return max(int((end - first_day).astype(int)) // step + 1, 1)
+
+    def occurrences(self, anchor, num_reps, first=1):
+        """Every occurrence date as a datetime64[D] array
+
+        'Starting From' rules begin at repetition first (1 is the first after the start date).
+        """
+        kind = self.frequency.kind
+        if kind == "once":
+            return recurrence.once(self.value)
+        if not self.active:
+            return recurrence.EMPTY
+        if kind == "once_per_month":
+            return recurrence.once_per_month(self.value, anchor, num_reps,
+                                             self.start_date, self.end_date)
+        if kind == "every_x_months":
+            return recurrence.every_x_months(self.value, self.frequency.step, num_reps, first)
+        if kind == "once_per_week":
+            return recurrence.once_per_week(self.value, anchor, num_reps)
+        return recurrence.every_x_weeks(self.value, self.frequency.step, num_reps, first)
+
+    def occurrences_between(self, anchor, end):
+        """Occurrences from anchor through end (a datetime64[D]), however old the start date"""
+        anchor = recurrence.to_anchor(anchor)
+        dates = self.occurrences(anchor, self.reps_until(anchor, end), self.first_rep(anchor))
+        return dates[(dates >= anchor) & (dates <= end)]
+
+
+class RuleCache:
+    """LRU cache of compiled rules keyed by the row values they were built from"""
+
+    def __init__(self, max_rules=MAX_CACHED_RULES):
+        self.max_rules = max_rules
+        self.rules = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, row):
+        key = tuple(row.get(field) for field in RULE_FIELDS)
+        try:
+            rule = self.rules.get(key)
+        except TypeError:
+            # Unhashable column value; compile without caching
+            return BillRule.from_row(row)
+        if rule is not None:
+            self.rules.move_to_end(key)
+            self.hits += 1
+            return rule
+
+        self.misses += 1
+        rule = BillRule.from_row(row)
+        self.rules[key] = rule
+        if len(self.rules) > self.max_rules:
+            self.rules.popitem(last=False)
+        return rule
+
+
+# Shared by every Bills instance in the process so rules survive across jobs
+RULE_CACHE = RuleCache()
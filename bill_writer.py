@@ -0,0 +1,66 @@
+"""
+Batched writer for vnd_bill_dates.
+
+Collects generated rows and flushes them as multi-row INSERT IGNORE
+statements. Duplicate (vnd_user_id, vnd_bill_desc, vnd_date) rows are
+dropped by the uq_bill_date unique key (see migrations.py), so no
+per-row existence check is needed.
+"""
+import recurrence
+
+COLUMNS = ("vnd_bill_desc", "vnd_user_id", "vnd_amount", "vnd_date", "vnd_is_future",
+           "is_heavy", "vnd_frequency", "vnd_frequency_type", "vnd_bill_id")
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class BillDateWriter:
+    def __init__(self, db_connection, chunk_size=DEFAULT_CHUNK_SIZE, metrics=None):
+        self.db = db_connection
+        self.metrics = metrics
+        self.cursor = self.db.cursor()
+        self.chunk_size = max(int(chunk_size), 1)
+        self.rows = []
+        self.rows_written = 0
+        self.rows_inserted = 0
+        self.round_trips = 0
+
+    def add(self, bill_desc, user_id, amount, date, is_future=0, is_heavy=0,
+            vnd_frequency="", vnd_frequency_type="", bill_id=None):
+        """Queue a single row, flushing when the chunk is full"""
+        self.rows.append((bill_desc, user_id, amount, date, is_future, is_heavy,
+                          vnd_frequency, vnd_frequency_type, bill_id))
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def add_dates(self, dates, bill_desc, user_id, amount, is_future=0, is_heavy=0,
+                  vnd_frequency="", vnd_frequency_type="", bill_id=None):
+        """Queue one row per date in a datetime64[D] array"""
+        for date_str in recurrence.date_strings(dates):
+            self.add(bill_desc, user_id, amount, date_str, is_future, is_heavy,
+                     vnd_frequency, vnd_frequency_type, bill_id)
+
+    def flush(self):
+        """Write all queued rows in chunk_size multi-row INSERT IGNORE statements"""
+        while self.rows:
+            chunk = self.rows[:self.chunk_size]
+            del self.rows[:self.chunk_size]
+
+            placeholders = "(" + ", ".join(["%s"] * len(COLUMNS)) + ")"
+            query = (f"INSERT IGNORE INTO vnd_bill_dates ({', '.join(COLUMNS)}) VALUES "
+                     + ", ".join([placeholders] * len(chunk)))
+            params = [value for row in chunk for value in row]
+
+            self.cursor.execute(query, params)
+            inserted = max(self.cursor.rowcount, 0)
+            self.round_trips += 1
+            self.rows_written += len(chunk)
+            self.rows_inserted += inserted
+            if self.metrics is not None:
+                self.metrics.rows_inserted += inserted
+                self.metrics.duplicates_skipped += len(chunk) - inserted
+
+    @property
+    def duplicates_skipped(self):
+        """Rows the database ignored because they already existed"""
+        return self.rows_written - self.rows_inserted
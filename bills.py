@@ -1,19 +1,56 @@
-import mysql.connector
-from datetime import datetime, timedelta
+from datetime import datetime
 import calendar
+import itertools
+import logging
+import sys
+import recurrence
+from bill_rule import RULE_CACHE
+from bill_writer import BillDateWriter, DEFAULT_CHUNK_SIZE
+from job_metrics import JobMetrics
+from occurrences import BillOccurrences
+from forecast import forecast_rules
+from pipeline import GenerationPipeline
+from log_setup import get_logger
+from pay_period_cache import ALL_USERS, PAY_PERIOD_CACHE, bump_version, read_version
 # import smtplib
 
+# Largest per-user existing-dates index kept in memory; bigger users fall
+# back to one SELECT per generated date
+MAX_INDEX_ENTRIES = 250000
+
+log = get_logger("bills")
+
 
 
 
 class Bills:
-    def __init__(self, num_reps=50, db_connection=None):
+    def __init__(self, num_reps=50, db_connection=None, batch_size=None, metrics=None,
+                 horizon_days=None):
         self.num_reps = num_reps
+        # With horizon_days, every bill generates its dates up to horizon_end
+        # (anchor + horizon_days) instead of num_reps occurrences
+        self.horizon_days = horizon_days
+        self.horizon_end = None
         self.today = ""
+        # self.today parsed once to datetime64[D] for the recurrence engine
+        self.anchor = None
         self.next_pay_day = None
         self.user_id = None
         self.db = db_connection
         self.cursor = self.db.cursor(dictionary=True) if db_connection else None
+        # Phase timings and row counters for the current job
+        self.metrics = metrics if metrics is not None else JobMetrics()
+        # With a batch size, rows go through INSERT IGNORE batches and rely on
+        # the uq_bill_date key instead of check_date_exists round-trips
+        self.writer = (BillDateWriter(db_connection, batch_size, self.metrics)
+                       if db_connection and batch_size else None)
+        # Compiled BillRules, shared across jobs in the worker process
+        self.rules = RULE_CACHE
+        # Pay-period reads, checked against vnd_bill_dates_version on every read
+        self.pay_periods = PAY_PERIOD_CACHE
+        # (vnd_bill_desc, vnd_date) pairs already stored for self.user_id, or None
+        self.existing_dates = None
+        self.max_index_entries = MAX_INDEX_ENTRIES
         
     def _ensure_string_date(self, date_value):
         """Convert date object to string if needed"""
@@ -50,19 +87,43 @@ class Bills:
             next_pay_day = current_date.replace(day=last_day).strftime("%Y-%m-%d")
         
         self.today = today
+        self.anchor = recurrence.to_anchor(today)
         self.next_pay_day = next_pay_day
+        if self.horizon_days:
+            self.horizon_end = self.anchor + int(self.horizon_days)
+        
+    def delete_old_dates(self, user_id=None, bill_id=None):
+        """Clean up old bill dates
         
-    def delete_old_dates(self):
-        """Clean up old bill dates and expired 'Once' bills"""
-        # Truncate bill dates table
-        query = "TRUNCATE vnd_bill_dates"
-        self.cursor.execute(query)
-        
-        # Delete expired 'Once' bills
-        sql = """DELETE FROM vnd_bills 
-                 WHERE vnd_frequency = 'Once' 
-                 AND DATE_SUB(NOW(), INTERVAL 2 DAY) > DATE(vnd_frequency_value)"""
-        self.cursor.execute(sql)
+        With bill_id only that bill's dates are removed (found by vnd_bill_id,
+        so rows of a renamed or deleted bill go too), with user_id only that
+        user's; with neither the whole vnd_bill_dates table is truncated.
+        Expired 'Once' bills are deleted by the worker's scheduled maintenance.
+        """
+        if bill_id is not None:
+            query = """SELECT vnd_user_id FROM vnd_bill_dates WHERE vnd_bill_id = %s
+                       UNION SELECT vnd_user_id FROM vnd_bills WHERE vnd_id = %s"""
+            self.cursor.execute(query, (bill_id, bill_id))
+            for row in self.cursor.fetchall():
+                bump_version(self.cursor, row['vnd_user_id'])
+            query = "DELETE FROM vnd_bill_dates WHERE vnd_bill_id = %s"
+            self.cursor.execute(query, (bill_id,))
+            # Rows written before vnd_bill_id existed can only be matched by description
+            query = """DELETE bd FROM vnd_bill_dates bd
+                       JOIN vnd_bills b 
+                         ON b.vnd_user_id = bd.vnd_user_id 
+                        AND b.vnd_bill = bd.vnd_bill_desc
+                       WHERE b.vnd_id = %s AND bd.vnd_bill_id IS NULL"""
+            self.cursor.execute(query, (bill_id,))
+        elif user_id is not None:
+            query = "DELETE FROM vnd_bill_dates WHERE vnd_user_id = %s"
+            self.cursor.execute(query, (user_id,))
+            bump_version(self.cursor, user_id)
+        else:
+            # Truncate bill dates table
+            query = "TRUNCATE vnd_bill_dates"
+            self.cursor.execute(query)
+            bump_version(self.cursor, ALL_USERS)
         self.db.commit()
         
     def load_bills_by_user_id(self, user_id):
@@ -74,18 +135,128 @@ class Bills:
         self.cursor.execute(query, (user_id,))
         return self.cursor.fetchall()
         
+    def load_bills_by_bill_id(self, bill_id):
+        """Load a bill plus any bills of the same user sharing its description"""
+        query = """SELECT b.* FROM vnd_bills b
+                   JOIN vnd_bills target 
+                     ON target.vnd_user_id = b.vnd_user_id 
+                    AND target.vnd_bill = b.vnd_bill
+                   WHERE target.vnd_id = %s
+                   ORDER BY b.vnd_frequency, b.vnd_frequency_type"""
+        
+        self.cursor.execute(query, (bill_id,))
+        return self.cursor.fetchall()
+        
     def load_bill_dates_by_user_id(self, user_id):
-        """Load bill dates for a specific user within the pay period"""
+        """Load bill dates for a specific user within the pay period
+        
+        Results are cached per (user, pay period). Repeated reads don't query
+        MySQL; once a cached result is VERSION_TTL seconds old the user's
+        vnd_bill_dates_version is checked, and the rows are read again only
+        if they were regenerated since (see pay_period_cache.py). Like the
+        query, cached results skip dates before self.today, a datetime, so
+        today's own dates are left out unless today is at midnight.
+        """
+        read = lambda: read_version(self.cursor, user_id)
+        rows = self.pay_periods.get(user_id, self.next_pay_day, read)
+        if rows is not None:
+            return [row for row in rows
+                    if f"{self._ensure_string_date(row['vnd_date'])} 00:00:00" >= self.today]
+        
+        version = read()
         query = """SELECT * FROM vnd_bill_dates 
                    WHERE vnd_user_id = %s
                    AND vnd_date BETWEEN %s AND %s
                    ORDER BY vnd_date, vnd_bill_desc"""
         
         self.cursor.execute(query, (user_id, self.today, self.next_pay_day))
-        return self.cursor.fetchall()
+        rows = self.cursor.fetchall()
+        self.pay_periods.put(user_id, self.next_pay_day, rows, version)
+        return list(rows)
+        
+    def rule_dates(self, rule):
+        """num_reps occurrences of rule, or in horizon mode its occurrences from the anchor to horizon_end"""
+        if self.horizon_end is None:
+            return rule.occurrences(self.anchor, self.num_reps)
+        return rule.occurrences_between(self.anchor, self.horizon_end)
+        
+    def _compile_rules(self, bills):
+        """Compile vnd_bills rows to BillRules, skipping (with a warning) rows that can't generate"""
+        rules = []
+        for bill in bills:
+            try:
+                rules.append(self.rules.get(bill))
+            except ValueError as e:
+                log.warning("%s for bill '%s', skipping", e, bill.get('vnd_bill', 'Unknown'))
+        return rules
+        
+    def iter_bill_dates_by_user_id(self, user_id):
+        """Lazily yield a user's bill dates in date order, computed from vnd_bills
+        
+        Needs set_pay_period() first. Use .between(start, end) for a window.
+        """
+        rules = self._compile_rules(self.load_bills_by_user_id(user_id))
+        return BillOccurrences(rules, user_id, self.anchor, self.num_reps)
+        
+    def load_pay_period_by_user_id(self, user_id):
+        """Pay period bill dates answered from vnd_bills, without a regenerated vnd_bill_dates"""
+        occurrences = self.iter_bill_dates_by_user_id(user_id)
+        return list(occurrences.between(self.today, self.next_pay_day))
+        
+    def forecast_by_user_id(self, user_id, periods=24):
+        """Bill totals for the user's next `periods` pay periods (needs set_pay_period() first)"""
+        rules = self._compile_rules(self.load_bills_by_user_id(user_id))
+        return forecast_rules(rules, self.anchor, periods)
+        
+    def forecast_all_users(self, stream_connection, periods=24):
+        """Yield (user_id, forecast) for every user from one ordered, unbuffered vnd_bills read"""
+        stream = stream_connection.cursor(dictionary=True, buffered=False)
+        query = """SELECT * FROM vnd_bills 
+                   ORDER BY vnd_user_id, vnd_frequency, vnd_frequency_type"""
+        stream.execute(query)
+        
+        for user_id, bills in itertools.groupby(stream, key=lambda bill: bill['vnd_user_id']):
+            yield user_id, forecast_rules(self._compile_rules(bills), self.anchor, periods)
+        
+        stream.close()
+        
+    def save_forecasts(self, forecasts):
+        """Insert (user_id, forecast) pairs into vnd_bill_forecast in one multi-row statement"""
+        rows = [(user_id, period['period_start'], period['period_end'], period['total'],
+                 period['num_bills'], int(period['has_heavy']), int(period['has_future']))
+                for user_id, forecast in forecasts for period in forecast]
+        if not rows:
+            return
+        
+        query = ("""INSERT INTO vnd_bill_forecast 
+                    (vnd_user_id, period_start, period_end, total, num_bills, has_heavy, has_future) 
+                    VALUES """ + ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(rows)))
+        self.cursor.execute(query, [value for row in rows for value in row])
+        
+    def load_existing_dates(self, user_id):
+        """Index the user's stored (vnd_bill_desc, vnd_date) pairs for check_date_exists"""
+        self.existing_dates = None
+        query = """SELECT vnd_bill_desc, vnd_date FROM vnd_bill_dates 
+                   WHERE vnd_user_id = %s 
+                   LIMIT %s"""
+        
+        self.cursor.execute(query, (user_id, self.max_index_entries + 1))
+        rows = self.cursor.fetchall()
+        if len(rows) > self.max_index_entries:
+            log.warning("User %s has more than %s stored dates, using per-row existence checks",
+                        user_id, self.max_index_entries)
+            return
+        
+        existing = {(row['vnd_bill_desc'], self._ensure_string_date(row['vnd_date'])) for row in rows}
+        size_kb = (sys.getsizeof(existing) + sum(sys.getsizeof(key) for key in existing)) / 1024
+        log.debug("Indexed %s existing dates for user %s (~%.0f KB)", len(existing), user_id, size_kb)
+        self.existing_dates = existing
         
     def check_date_exists(self, bill_desc, date, user_id):
         """Check if a bill date already exists"""
+        if self.existing_dates is not None and user_id == self.user_id:
+            return (bill_desc, date) in self.existing_dates
+        
         query = """SELECT vnd_id FROM vnd_bill_dates 
                    WHERE vnd_bill_desc = %s 
                    AND vnd_date = %s 
@@ -96,263 +267,144 @@ class Bills:
         return len(self.cursor.fetchall()) > 0
         
     def insert_bill_date(self, bill_desc, user_id, amount, date, is_future=0, 
-                        is_heavy=0, vnd_frequency="", vnd_frequency_type=""):
+                        is_heavy=0, vnd_frequency="", vnd_frequency_type="", bill_id=None):
         """Insert a new bill date"""
         query = """INSERT INTO vnd_bill_dates 
                    (vnd_bill_desc, vnd_user_id, vnd_amount, vnd_date, vnd_is_future, 
-                    is_heavy, vnd_frequency, vnd_frequency_type) 
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"""
+                    is_heavy, vnd_frequency, vnd_frequency_type, vnd_bill_id) 
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
         
         self.cursor.execute(query, (bill_desc, user_id, amount, date, is_future, 
-                                   is_heavy, vnd_frequency, vnd_frequency_type))
-        
-    def load_once(self, freq_value, bill_desc, amount, freq_type, is_future=0, 
-                  is_heavy=0, vnd_frequency="", vnd_frequency_type=""):
-        """Load a one-time bill"""
-        freq_value_str = self._ensure_string_date(freq_value)
-        if not self.check_date_exists(bill_desc, freq_value_str, self.user_id):
-            self.insert_bill_date(bill_desc, self.user_id, amount, freq_value_str, 
-                                 is_future, is_heavy, vnd_frequency, vnd_frequency_type)
-            
-    def load_once_per_month(self, freq_value, bill_desc, amount, freq_type="Day of Month", 
-                           is_future=0, is_heavy=0, vnd_frequency="", vnd_frequency_type="",
-                           end_date=None, start_date=None):
-        """Load monthly recurring bills"""
-        if freq_type == "Day of Month":
-            # Validate and convert freq_value to int
-            try:
-                if not freq_value or str(freq_value).strip() == "":
-                    print(f"Warning: Empty freq_value for bill '{bill_desc}', skipping")
-                    return
-                freq_value = int(freq_value)
-                if freq_value < 1 or freq_value > 31:
-                    print(f"Warning: Invalid day of month '{freq_value}' for bill '{bill_desc}', skipping")
-                    return
-            except (ValueError, TypeError) as e:
-                print(f"Warning: Cannot convert freq_value '{freq_value}' to integer for bill '{bill_desc}': {e}")
-                return
-                
-            today_date = datetime.strptime(self.today, "%Y-%m-%d %H:%M:%S")
-            month = today_date.month
-            year = today_date.year
-            
-            for i in range(self.num_reps):
-                # Handle February with day > 28
-                if month == 2 and freq_value > 28:
-                    freq_value = 28
-                    
-                if freq_value < 32:
-                    try:
-                        bill_date = datetime(year, month, freq_value)
-                        date_str = bill_date.strftime("%Y-%m-%d")
-                        
-                        # Check future validation
-                        passes_future_validation = True
-                        if end_date and end_date != "0000-00-00":
-                            end_date_str = self._ensure_string_date(end_date)
-                            if end_date_str and bill_date > datetime.strptime(end_date_str, "%Y-%m-%d"):
-                                passes_future_validation = False
-                                
-                        # Check past validation  
-                        passes_prev_validation = True
-                        if start_date and start_date != "0000-00-00":
-                            start_date_str = self._ensure_string_date(start_date)
-                            if start_date_str and bill_date < datetime.strptime(start_date_str, "%Y-%m-%d"):
-                                passes_prev_validation = False
-                                
-                        if passes_future_validation and passes_prev_validation:
-                            if not self.check_date_exists(bill_desc, date_str, self.user_id):
-                                self.insert_bill_date(bill_desc, self.user_id, amount, date_str,
-                                                     is_future, is_heavy, vnd_frequency, vnd_frequency_type)
-                    except ValueError:
-                        # Invalid date (like Feb 30), skip
-                        pass
-                        
-                # Move to next month
-                if month < 12:
-                    month += 1
-                else:
-                    year += 1
-                    month = 1
-                    
-    def load_every_x_months(self, freq_value, bill_desc, amount, freq_type="Starting From", 
-                           num_months=1, is_future=0, is_heavy=0, vnd_frequency="", 
-                           vnd_frequency_type=""):
-        """Load bills that occur every X months"""
-        if freq_type == "Starting From":
-            num_days = num_months * 30
-            freq_value_str = self._ensure_string_date(freq_value)
-            if not freq_value_str:
-                print(f"Warning: Invalid freq_value for Every X Months: {freq_value}")
-                return
-            try:
-                start_date = datetime.strptime(freq_value_str, "%Y-%m-%d")
-            except ValueError as e:
-                print(f"Error parsing date '{freq_value_str}': {e}")
-                return
-            each_date = start_date
-            
-            if num_months == 0:
-                num_months = 1
-                
-            for i in range(self.num_reps):
-                use_date = each_date + timedelta(days=num_days)
-                date_str = use_date.strftime("%Y-%m-%d")
-                
-                if not self.check_date_exists(bill_desc, date_str, self.user_id):
-                    self.insert_bill_date(bill_desc, self.user_id, amount, date_str,
-                                         is_future, is_heavy, vnd_frequency, vnd_frequency_type)
-                
-                each_date = use_date
-                
-    def load_once_per_week(self, freq_value, bill_desc, amount, freq_type="Day of Week", 
-                          is_future=0, is_heavy=0, vnd_frequency="", vnd_frequency_type=""):
-        """Load weekly recurring bills"""
-        if freq_type == "Day of Week":
-            # Validate and convert freq_value to int
-            try:
-                if not freq_value or str(freq_value).strip() == "":
-                    print(f"Warning: Empty freq_value for bill '{bill_desc}', skipping")
-                    return
-                target_day = int(freq_value)
-                if target_day < 0 or target_day > 6:
-                    print(f"Warning: Invalid day of week '{target_day}' for bill '{bill_desc}', skipping")
-                    return
-            except (ValueError, TypeError) as e:
-                print(f"Warning: Cannot convert freq_value '{freq_value}' to integer for bill '{bill_desc}': {e}")
-                return
-                
-            today_date = datetime.strptime(self.today, "%Y-%m-%d %H:%M:%S")
-            current_day = today_date.weekday()  # Monday = 0, Sunday = 6
-            
-            # Convert PHP weekday (Sunday=0) to Python weekday (Monday=0)
-            if target_day == 0:  # Sunday in PHP
-                target_day = 6  # Sunday in Python
+                                   is_heavy, vnd_frequency, vnd_frequency_type, bill_id))
+        if self.existing_dates is not None and user_id == self.user_id:
+            self.existing_dates.add((bill_desc, date))
+        
+    def _save_dates(self, dates, bill_desc, amount, is_future=0, is_heavy=0,
+                    vnd_frequency="", vnd_frequency_type="", bill_id=None):
+        """Insert each generated date that isn't already stored"""
+        if self.writer:
+            self.writer.add_dates(dates, bill_desc, self.user_id, amount, is_future,
+                                  is_heavy, vnd_frequency, vnd_frequency_type, bill_id)
+            return
+        for date_str in recurrence.date_strings(dates):
+            if not self.check_date_exists(bill_desc, date_str, self.user_id):
+                self.insert_bill_date(bill_desc, self.user_id, amount, date_str,
+                                     is_future, is_heavy, vnd_frequency, vnd_frequency_type,
+                                     bill_id)
+                self.metrics.rows_inserted += 1
             else:
-                target_day -= 1  # Adjust for Monday=0 in Python
-                
-            weekday_diff = target_day - current_day
-            if weekday_diff <= 0:
-                weekday_diff += 7
-                
-            start_date = today_date + timedelta(days=weekday_diff)
-            each_date = start_date
-            
-            for i in range(self.num_reps):
-                use_date = each_date + timedelta(days=7)
-                date_str = use_date.strftime("%Y-%m-%d")
-                
-                if not self.check_date_exists(bill_desc, date_str, self.user_id):
-                    self.insert_bill_date(bill_desc, self.user_id, amount, date_str,
-                                         is_future, is_heavy, vnd_frequency, vnd_frequency_type)
-                
-                each_date = use_date
-                
-    def load_every_x_weeks(self, freq_value, bill_desc, amount, freq_type="Starting From", 
-                          num_weeks=2, is_future=0, is_heavy=0, vnd_frequency="", 
-                          vnd_frequency_type=""):
-        """Load bills that occur every X weeks"""
-        if freq_type == "Starting From":
-            num_days = num_weeks * 7
-            freq_value_str = self._ensure_string_date(freq_value)
-            if not freq_value_str:
-                print(f"Warning: Invalid freq_value for Every X Weeks: {freq_value}")
-                return
-            try:
-                start_date = datetime.strptime(freq_value_str, "%Y-%m-%d")
-            except ValueError as e:
-                print(f"Error parsing date '{freq_value_str}': {e}")
-                return
-            each_date = start_date
-            
-            if num_weeks == 0:
-                num_weeks = 1
-                
-            for i in range(self.num_reps):
-                use_date = each_date + timedelta(days=num_days)
-                date_str = use_date.strftime("%Y-%m-%d")
-                
-                if not self.check_date_exists(bill_desc, date_str, self.user_id):
-                    self.insert_bill_date(bill_desc, self.user_id, amount, date_str,
-                                         is_future, is_heavy, vnd_frequency, vnd_frequency_type)
-                
-                each_date = use_date
-                
+                self.metrics.duplicates_skipped += 1
+        
     def generate_bill_dates_by_user_id(self, user_id):
         """Generate all bill dates for a user based on their bill frequencies"""
         self.user_id = user_id
-        bills = self.load_bills_by_user_id(user_id)
+        with self.metrics.phase("load_bills"):
+            if not self.writer:
+                self.load_existing_dates(user_id)
+            bills = self.load_bills_by_user_id(user_id)
+        self.generate_bill_dates(bills)
         
-        for bill in bills:
-            try:
+    def generate_bill_dates_by_bill_id(self, bill_id):
+        """Generate bill dates for a single bill (and same-named bills of its user)"""
+        with self.metrics.phase("load_bills"):
+            bills = self.load_bills_by_bill_id(bill_id)
+            if not bills:
+                log.info("Bill %s not found, nothing to generate", bill_id)
+                return
+            
+            self.user_id = bills[0]['vnd_user_id']
+            if not self.writer:
+                self.load_existing_dates(self.user_id)
+        self.generate_bill_dates(bills)
+        
+    def generate_all_users(self, stream_connection):
+        """Generate bill dates for every user from one ordered, unbuffered vnd_bills read
+        
+        stream_connection must be a separate connection from this instance's: its
+        result set stays open while each user's dates are written and committed.
+        Only the current user's bills are held in memory.
+        """
+        stream = stream_connection.cursor(dictionary=True, buffered=False)
+        query = """SELECT * FROM vnd_bills 
+                   ORDER BY vnd_user_id, vnd_frequency, vnd_frequency_type"""
+        with self.metrics.phase("load_bills"):
+            stream.execute(query)
+        
+        num_users = 0
+        for user_id, bills in itertools.groupby(stream, key=lambda bill: bill['vnd_user_id']):
+            self.user_id = user_id
+            if not self.writer:
+                with self.metrics.phase("load_bills"):
+                    self.load_existing_dates(user_id)
+            self.generate_bill_dates(bills)
+            num_users += 1
+        
+        stream.close()
+        return num_users
+        
+    def generate_to_file(self, stream_connection, out):
+        """Stream every user's dates into out (a bulk_load.BillDateFile) instead of the database
+        
+        Used for bulk rebuilds and offline snapshots; this instance needs no
+        connection of its own.
+        """
+        writer, self.writer = self.writer, out
+        try:
+            return self.generate_all_users(stream_connection)
+        finally:
+            self.writer = writer
+        
+    def generate_pipelined(self, read_connection, user_id=None):
+        """Generate one user's (or with user_id=None every user's) dates through a GenerationPipeline
+        
+        Bills are streamed on read_connection while this instance's connection
+        writes INSERT IGNORE batches, so reads, date computation and writes overlap.
+        """
+        if user_id is None:
+            query = """SELECT * FROM vnd_bills 
+                       ORDER BY vnd_user_id, vnd_frequency, vnd_frequency_type"""
+            params = ()
+        else:
+            query = """SELECT * FROM vnd_bills 
+                       WHERE vnd_user_id = %s 
+                       ORDER BY vnd_frequency, vnd_frequency_type"""
+            params = (user_id,)
+        
+        batch_size = self.writer.chunk_size if self.writer else DEFAULT_CHUNK_SIZE
+        with self.metrics.phase("generate"):
+            num_users = GenerationPipeline(self, read_connection, batch_size).run(query, params)
+        return num_users
+        
+    def generate_bill_dates(self, bills):
+        """Generate and store dates for the given vnd_bills rows of self.user_id"""
+        # Checked once per call so per-bill tracing costs nothing unless the job enables it
+        trace = log.isEnabledFor(logging.DEBUG)
+        with self.metrics.phase("generate"):
+            for bill in bills:
                 frequency = bill['vnd_frequency']
-                print(f"Processing bill: {bill.get('vnd_bill', 'Unknown')} with frequency: {frequency}")
-                
-                if frequency == "Once":
-                    print(f"  -> Processing as 'Once' with value: {bill['vnd_frequency_value']}")
-                    self.load_once(
-                        bill['vnd_frequency_value'], bill['vnd_bill'], bill['amount'],
-                        bill['vnd_frequency_type'], bill.get('is_future', 0), 
-                        bill.get('is_heavy', 0), bill['vnd_frequency'], bill['vnd_frequency_type']
-                    )
-                elif frequency == "Once Per Month":
-                    print(f"  -> Processing as 'Once Per Month' with value: {bill['vnd_frequency_value']}, type: {bill['vnd_frequency_type']}")
-                    self.load_once_per_month(
-                        bill['vnd_frequency_value'], bill['vnd_bill'], bill['amount'],
-                        bill['vnd_frequency_type'], bill.get('is_future', 0), 
-                        bill.get('is_heavy', 0), bill['vnd_frequency'], bill['vnd_frequency_type'],
-                        bill.get('end_date'), bill.get('start_date')
-                    )
-                elif frequency == "Every 3 Months":
-                    print(f"  -> Processing as 'Every 3 Months' with value: {bill['vnd_frequency_value']}, type: {bill['vnd_frequency_type']}")
-                    self.load_every_x_months(
-                        bill['vnd_frequency_value'], bill['vnd_bill'], bill['amount'],
-                        bill['vnd_frequency_type'], 3, bill.get('is_future', 0), 
-                        bill.get('is_heavy', 0), bill['vnd_frequency'], bill['vnd_frequency_type']
-                    )
-                elif frequency == "Every 1 Month":
-                    print(f"  -> Processing as 'Every 1 Month' with value: {bill['vnd_frequency_value']}, type: {bill['vnd_frequency_type']}")
-                    self.load_every_x_months(
-                        bill['vnd_frequency_value'], bill['vnd_bill'], bill['amount'],
-                        bill['vnd_frequency_type'], 1, bill.get('is_future', 0), 
-                        bill.get('is_heavy', 0), bill['vnd_frequency'], bill['vnd_frequency_type']
-                    )
-                elif frequency == "Once Per Week":
-                    print(f"  -> Processing as 'Once Per Week' with value: {bill['vnd_frequency_value']}, type: {bill['vnd_frequency_type']}")
-                    self.load_once_per_week(
-                        bill['vnd_frequency_value'], bill['vnd_bill'], bill['amount'],
-                        bill['vnd_frequency_type'], bill.get('is_future', 0), 
-                        bill.get('is_heavy', 0), bill['vnd_frequency'], bill['vnd_frequency_type']
-                    )
-                elif frequency == "Every 2 Weeks":
-                    print(f"  -> Processing as 'Every 2 Weeks' with value: {bill['vnd_frequency_value']}, type: {bill['vnd_frequency_type']}")
-                    self.load_every_x_weeks(
-                        bill['vnd_frequency_value'], bill['vnd_bill'], bill['amount'],
-                        bill['vnd_frequency_type'], 2, bill.get('is_future', 0), 
-                        bill.get('is_heavy', 0), bill['vnd_frequency'], bill['vnd_frequency_type']
-                    )
-                elif frequency == "Every 1 Week":
-                    print(f"  -> Processing as 'Every 1 Week' with value: {bill['vnd_frequency_value']}, type: {bill['vnd_frequency_type']}")
-                    self.load_every_x_weeks(
-                        bill['vnd_frequency_value'], bill['vnd_bill'], bill['amount'],
-                        bill['vnd_frequency_type'], 1, bill.get('is_future', 0), 
-                        bill.get('is_heavy', 0), bill['vnd_frequency'], bill['vnd_frequency_type']
-                    )
-                elif frequency == "Every 4 Weeks":
-                    print(f"  -> Processing as 'Every 4 Weeks' with value: {bill['vnd_frequency_value']}, type: {bill['vnd_frequency_type']}")
-                    self.load_every_x_weeks(
-                        bill['vnd_frequency_value'], bill['vnd_bill'], bill['amount'],
-                        bill['vnd_frequency_type'], 4, bill.get('is_future', 0), 
-                        bill.get('is_heavy', 0), bill['vnd_frequency'], bill['vnd_frequency_type']
-                    )
-                else:
-                    print(f"  -> Unknown frequency type: {frequency}")
-            except Exception as e:
-                print(f"Error processing bill {bill.get('vnd_bill', 'Unknown')} (freq: {frequency}): {str(e)}")
-                # Continue processing other bills instead of stopping
-                continue
+                self.metrics.bills_by_frequency[frequency] += 1
+                if trace:
+                    log.debug("Processing bill: %s with frequency: %s, value: %s, type: %s",
+                              bill.get('vnd_bill', 'Unknown'), frequency, bill['vnd_frequency_value'],
+                              bill['vnd_frequency_type'], extra={"user_id": self.user_id})
+                try:
+                    rule = self.rules.get(bill)
+                    dates = self.rule_dates(rule)
+                    self._save_dates(dates, rule.bill_desc, rule.amount, rule.is_future, rule.is_heavy,
+                                     frequency, rule.frequency_type, bill.get('vnd_id'))
+                except ValueError as e:
+                    log.warning("%s for bill '%s', skipping", e, bill.get('vnd_bill', 'Unknown'))
+                except Exception:
+                    log.exception("Error processing bill %s (freq: %s)", bill.get('vnd_bill', 'Unknown'), frequency)
+                    # Continue processing other bills instead of stopping
+                    continue
         
-        self.db.commit()
+            if self.writer:
+                self.writer.flush()
+        if self.db:
+            with self.metrics.phase("commit"):
+                bump_version(self.cursor, self.user_id)
+                self.db.commit()
         
     # def send_future_charges(self):
     #     """Send email notification for upcoming future charges"""
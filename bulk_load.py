@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Bulk export and load of generated bill dates.
+
+BillDateFile has the same add/add_dates/flush interface as BillDateWriter
+but streams rows to a file instead of the database, so Bills can generate
+straight into it with constant memory. Files ending in .tsv are in the
+default LOAD DATA format and can be loaded into vnd_bill_dates with
+load_bill_dates_file. Files ending in .jsonl or .jsonl.gz hold one JSON
+object per row and are meant for offline analytics snapshots.
+
+Usage: python bulk_load.py export <path> [num_reps]
+       python bulk_load.py load <path.tsv>
+"""
+import gzip
+import json
+import os
+import sys
+
+import recurrence
+from bill_writer import COLUMNS
+from db_pool import BULK_LOAD_DIR, connect
+
+FORMATS = (".tsv", ".jsonl", ".jsonl.gz")
+
+# LOAD DATA's default escaping: backslash first, then the field and line terminators
+_TSV_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"})
+
+
+def _tsv_field(value):
+    if value is None:
+        return "\\N"
+    return str(value).translate(_TSV_ESCAPES)
+
+
+class BillDateFile:
+    def __init__(self, path):
+        if not path.endswith(FORMATS):
+            raise ValueError(f"Unsupported bulk file format: {path} (expected one of {', '.join(FORMATS)})")
+        self.path = path
+        self.jsonl = not path.endswith(".tsv")
+        opener = gzip.open if path.endswith(".gz") else open
+        self.file = opener(path, "wt", encoding="utf-8", newline="\n")
+        self.rows_written = 0
+        # Filled in by load_bill_dates_file
+        self.rows_inserted = 0
+        self.round_trips = 0
+        # Like uq_bill_date, each (description, date) is written once per user;
+        # generation runs user by user, so only the current user's keys are kept
+        self._user_id = None
+        self._seen = set()
+
+    def add(self, bill_desc, user_id, amount, date, is_future=0, is_heavy=0,
+            vnd_frequency="", vnd_frequency_type="", bill_id=None):
+        if user_id != self._user_id:
+            self._user_id = user_id
+            self._seen = set()
+        key = (bill_desc, date)
+        if key in self._seen:
+            return
+        self._seen.add(key)
+
+        row = (bill_desc, user_id, amount, date, is_future, is_heavy, vnd_frequency,
+               vnd_frequency_type, bill_id)
+        if self.jsonl:
+            self.file.write(json.dumps(dict(zip(COLUMNS, row)), default=str) + "\n")
+        else:
+            self.file.write("\t".join(_tsv_field(value) for value in row) + "\n")
+        self.rows_written += 1
+
+    def add_dates(self, dates, bill_desc, user_id, amount, is_future=0, is_heavy=0,
+                  vnd_frequency="", vnd_frequency_type="", bill_id=None):
+        for date_str in recurrence.date_strings(dates):
+            self.add(bill_desc, user_id, amount, date_str, is_future, is_heavy,
+                     vnd_frequency, vnd_frequency_type, bill_id)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def duplicates_skipped(self):
+        return self.rows_written - self.rows_inserted
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_bill_dates_file(db, path):
+    """LOAD DATA LOCAL INFILE a .tsv BillDateFile into vnd_bill_dates; returns the rows inserted
+
+    The connection must allow local infile from the file's directory (db_pool
+    allows BULK_LOAD_DIR) and the server needs local_infile enabled. Rows that
+    hit uq_bill_date are skipped, as with INSERT IGNORE.
+    """
+    if not path.endswith(".tsv"):
+        raise ValueError(f"Only .tsv files can be bulk loaded, not {path}")
+    cursor = db.cursor()
+    cursor.execute(f"""LOAD DATA LOCAL INFILE %s
+                       IGNORE INTO TABLE vnd_bill_dates
+                       CHARACTER SET utf8mb4
+                       FIELDS TERMINATED BY '\\t'
+                       LINES TERMINATED BY '\\n'
+                       ({', '.join(COLUMNS)})""", (os.path.abspath(path),))
+    inserted = max(cursor.rowcount, 0)
+    cursor.close()
+    return inserted
+
+
+def bulk_file_path(name):
+    """Path for a bulk load file inside BULK_LOAD_DIR"""
+    os.makedirs(BULK_LOAD_DIR, exist_ok=True)
+    return os.path.join(BULK_LOAD_DIR, name)
+
+
+if __name__ == "__main__":
+    from bills import Bills
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ("export", "load"):
+        print(__doc__)
+        sys.exit(1)
+    action, path = sys.argv[1], sys.argv[2]
+    db = connect()
+    if action == "export":
+        num_reps = int(sys.argv[3]) if len(sys.argv) > 3 else 42
+        bill = Bills(num_reps)
+        bill.set_pay_period()
+        with BillDateFile(path) as out:
+            num_users = bill.generate_to_file(db, out)
+        print(f"Exported {out.rows_written} bill dates for {num_users} users to {path}")
+    else:
+        inserted = load_bill_dates_file(db, path)
+        db.commit()
+        print(f"Loaded {inserted} bill dates from {path}")
+    db.close()
@@ -0,0 +1,99 @@
+"""
+Pooled MySQL connections for the worker.
+
+Each worker process keeps one small pool per database (production and
+test). Jobs borrow a connection, and close() hands it back to the pool
+instead of dropping it, so jobs skip the connect handshake and can't leak
+connections.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import errors, pooling
+
+# LOAD DATA LOCAL INFILE may only read files from this directory (see bulk_load.py)
+BULK_LOAD_DIR = os.environ.get("BILLS_BULK_LOAD_DIR", "/tmp/bills_bulk_load")
+
+DATABASES = {
+    "production": {
+        "host": "",
+        "user": "",
+        "password": "",
+        "database": "",
+        "allow_local_infile_in_path": BULK_LOAD_DIR,
+    },
+    "test": {
+        "host": "",
+        "user": "",
+        "password": "",
+        "database": "",
+        "allow_local_infile_in_path": BULK_LOAD_DIR,
+    },
+}
+
+# Connections per pool per process (mysql-connector caps pools at 32)
+MAX_POOL_SIZE = int(os.environ.get("BILLS_DB_POOL_SIZE", "4"))
+
+# How long get_connection waits for a free connection before giving up
+POOL_WAIT_SECONDS = 30
+
+
+def connect(test_mode=False):
+    """Open a standalone (unpooled) connection to the test or production database"""
+    return mysql.connector.connect(**DATABASES["test" if test_mode else "production"])
+
+
+class ConnectionManager:
+    def __init__(self, databases=DATABASES, pool_size=MAX_POOL_SIZE):
+        self.databases = databases
+        self.pool_size = pool_size
+        self.pools = {}
+        # Shell job and archiver threads borrow connections alongside the main loop
+        self.lock = threading.Lock()
+
+    def _pool(self, name):
+        """Create the named pool on first use (after any fork, so it is per process)"""
+        with self.lock:
+            pool = self.pools.get(name)
+            if pool is None:
+                pool = pooling.MySQLConnectionPool(
+                    pool_name=f"bills_{name}_{os.getpid()}",
+                    pool_size=self.pool_size,
+                    pool_reset_session=True,
+                    **self.databases[name]
+                )
+                self.pools[name] = pool
+            return pool
+
+    def get_connection(self, test_mode=False):
+        """Borrow a live connection; close() returns it to the pool"""
+        pool = self._pool("test" if test_mode else "production")
+        deadline = time.monotonic() + POOL_WAIT_SECONDS
+        while True:
+            try:
+                conn = pool.get_connection()
+                break
+            except errors.PoolError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        # Health check: re-open the connection if the server dropped it
+        try:
+            conn.ping(reconnect=True, attempts=3, delay=1)
+        except errors.Error:
+            conn.close()
+            raise
+        return conn
+
+    @contextmanager
+    def connection(self, test_mode=False):
+        """Borrow a connection for the duration of a with block"""
+        conn = self.get_connection(test_mode)
+        try:
+            yield conn
+        finally:
+            conn.close()
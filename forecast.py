@@ -0,0 +1,87 @@
+"""
+Multi-period cash-flow forecast.
+
+Splits a horizon into pay periods using the same rule as
+Bills.set_pay_period: pay days fall on the 14th and on the last day of
+each month. It then totals a user's bill amounts per period with array
+operations over the compiled rules' occurrences. No SQL aggregation is
+involved.
+"""
+import numpy as np
+
+import recurrence
+
+DAY = recurrence.DAY
+
+
+def pay_days(anchor, periods):
+    """The next `periods` pay days from anchor (the 14th or month end, as set_pay_period picks)"""
+    anchor = recurrence.to_anchor(anchor)
+    month = anchor.astype("datetime64[M]")
+    months = month + np.arange(periods // 2 + 2)
+    fourteenths = months.astype(DAY) + 13
+    month_ends = (months + 1).astype(DAY) - 1
+    candidates = np.column_stack([fourteenths, month_ends]).ravel()
+    first = 0 if anchor < month.astype(DAY) + 14 else 1
+    return candidates[first:first + periods]
+
+
+def forecast_rules(rules, anchor, periods):
+    """Total the rules' occurrences per pay period from anchor
+
+    Returns one dict per period with period_start, period_end, total,
+    num_bills, has_heavy and has_future. Like vnd_bill_dates, a
+    description/date pair is only counted once.
+    """
+    anchor = recurrence.to_anchor(anchor)
+    ends = pay_days(anchor, periods)
+    starts = np.concatenate([[anchor], ends[:-1] + 1])
+    horizon = ends[-1]
+
+    dates, amounts, heavy, future, desc_codes = [], [], [], [], []
+    codes = {}
+    for rule in rules:
+        occurrences = rule.occurrences_between(anchor, horizon)
+        count = len(occurrences)
+        if not count:
+            continue
+        dates.append(occurrences)
+        amounts.append(np.full(count, float(rule.amount or 0)))
+        heavy.append(np.full(count, bool(rule.is_heavy)))
+        future.append(np.full(count, bool(rule.is_future)))
+        desc_codes.append(np.full(count, codes.setdefault(rule.bill_desc, len(codes)), dtype=np.int64))
+
+    totals = np.zeros(periods)
+    num_bills = np.zeros(periods, dtype=np.int64)
+    has_heavy = np.zeros(periods, dtype=bool)
+    has_future = np.zeros(periods, dtype=bool)
+    if dates:
+        dates = np.concatenate(dates)
+        amounts = np.concatenate(amounts)
+        heavy = np.concatenate(heavy)
+        future = np.concatenate(future)
+
+        # Drop repeated (description, date) pairs, keeping the first bill
+        keys = (np.concatenate(desc_codes) << 32) + dates.astype(np.int64)
+        _, first = np.unique(keys, return_index=True)
+        keep = np.zeros(len(keys), dtype=bool)
+        keep[first] = True
+        keep &= (dates >= anchor) & (dates <= horizon)
+
+        period = np.searchsorted(ends, dates[keep])
+        totals = np.bincount(period, weights=amounts[keep], minlength=periods)
+        num_bills = np.bincount(period, minlength=periods)
+        has_heavy = np.bincount(period, weights=heavy[keep], minlength=periods) > 0
+        has_future = np.bincount(period, weights=future[keep], minlength=periods) > 0
+
+    return [
+        {
+            'period_start': str(starts[i]),
+            'period_end': str(ends[i]),
+            'total': round(float(totals[i]), 2),
+            'num_bills': int(num_bills[i]),
+            'has_heavy': bool(has_heavy[i]),
+            'has_future': bool(has_future[i]),
+        }
+        for i in range(periods)
+    ]
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Move finished date_job rows into date_job_history.
+
+Jobs that are done, errored or cancelled and older than the retention
+window are copied and deleted in chunks by id, with a short pause between
+chunks, so date_job only holds recent work and the pending-job poll stays
+cheap. It runs with the worker's scheduled maintenance (maintenance.py);
+it can also be run by hand: python job_archive.py
+"""
+import os
+import time
+
+from db_pool import connect
+
+# Finished jobs younger than this many days stay in date_job
+ARCHIVE_RETENTION_DAYS = int(os.environ.get("BILLS_ARCHIVE_RETENTION_DAYS", "30"))
+
+# Rows moved per transaction, and the pause between transactions
+ARCHIVE_CHUNK_SIZE = 1000
+ARCHIVE_PAUSE = 0.1
+
+FINISHED_STATUSES = ('done', 'error', 'cancelled')
+
+
+def archive_finished_jobs(db, retention_days=ARCHIVE_RETENTION_DAYS, chunk_size=ARCHIVE_CHUNK_SIZE,
+                          pause=ARCHIVE_PAUSE):
+    """Move finished jobs older than retention_days to date_job_history; returns the number moved"""
+    cursor = db.cursor()
+    statuses = ", ".join(["%s"] * len(FINISHED_STATUSES))
+    moved = 0
+    while True:
+        # Served by the (status, created_at) index
+        cursor.execute(f"""SELECT id FROM date_job
+                           WHERE status IN ({statuses})
+                           AND created_at < NOW() - INTERVAL %s DAY
+                           ORDER BY created_at
+                           LIMIT %s""", FINISHED_STATUSES + (retention_days, chunk_size))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            db.commit()
+            break
+
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(f"INSERT IGNORE INTO date_job_history SELECT * FROM date_job WHERE id IN ({placeholders})", ids)
+        cursor.execute(f"DELETE FROM date_job WHERE id IN ({placeholders})", ids)
+        db.commit()
+        moved += len(ids)
+        if len(ids) < chunk_size:
+            break
+        time.sleep(pause)
+
+    cursor.close()
+    return moved
+
+
+if __name__ == "__main__":
+    db = connect()
+    print(f"Archived {archive_finished_jobs(db)} finished jobs to date_job_history")
+    db.close()
@@ -0,0 +1,191 @@
+"""
+Per-job performance metrics for the worker.
+
+JobMetrics collects phase timings, query counts/time and row counters
+for a single job and serialises them to JSON for date_job.metrics.
+InstrumentedConnection wraps a DB connection so every query made through
+it is counted. PrometheusTextfile keeps aggregate counters and latency
+histograms and writes them in the Prometheus text format for
+node_exporter's textfile collector.
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Job duration histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class JobMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.wall_seconds = None
+        self.phases = Counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        # Pipelined jobs record queries from several threads
+        self._query_lock = threading.Lock()
+        self.rows_inserted = 0
+        self.duplicates_skipped = 0
+        self.bills_by_frequency = Counter()
+        # cProfile dump of a profiled job (see profiling.py)
+        self.profile = None
+
+    @contextmanager
+    def phase(self, name):
+        """Add the wall time of a with block to the named phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def record_query(self, seconds):
+        with self._query_lock:
+            self.queries += 1
+            self.query_seconds += seconds
+
+    def finish(self):
+        """Stop the wall clock; later calls keep the first measurement"""
+        if self.wall_seconds is None:
+            self.wall_seconds = time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            "wall_seconds": round(self.wall_seconds, 6) if self.wall_seconds is not None else None,
+            "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            "queries": self.queries,
+            "query_seconds": round(self.query_seconds, 6),
+            "rows_inserted": self.rows_inserted,
+            "duplicates_skipped": self.duplicates_skipped,
+            "bills_by_frequency": dict(self.bills_by_frequency),
+            "profile": self.profile,
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict())
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times execute/executemany into a JobMetrics"""
+
+    def __init__(self, cursor, metrics):
+        self._cursor = cursor
+        self._metrics = metrics
+
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        finally:
+            self._metrics.record_query(time.perf_counter() - start)
+
+    def executemany(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(*args, **kwargs)
+        finally:
+            self._metrics.record_query(time.perf_counter() - start)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """Connection proxy whose cursors and commits are counted in a JobMetrics"""
+
+    def __init__(self, connection, metrics):
+        self._connection = connection
+        self._metrics = metrics
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs), self._metrics)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return self._connection.commit()
+        finally:
+            self._metrics.record_query(time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class PrometheusTextfile:
+    """Aggregate worker counters and job latency histograms in Prometheus text format"""
+
+    def __init__(self, path, labels=None):
+        self.path = path
+        self.labels = labels or {}
+        self.jobs = Counter()
+        self.counters = Counter()
+        self.phase_seconds = Counter()
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.duration_sum = 0.0
+        self.duration_count = 0
+
+    def observe(self, metrics, status):
+        """Fold a finished job's metrics into the aggregates"""
+        self.jobs[status] += 1
+        self.counters["queries"] += metrics.queries
+        self.counters["query_seconds"] += metrics.query_seconds
+        self.counters["rows_inserted"] += metrics.rows_inserted
+        self.counters["duplicates_skipped"] += metrics.duplicates_skipped
+        self.phase_seconds.update(metrics.phases)
+
+        duration = metrics.wall_seconds or 0.0
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                self.bucket_counts[index] += 1
+        self.duration_sum += duration
+        self.duration_count += 1
+
+    def _labels(self, **extra):
+        labels = dict(self.labels, **extra)
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+    def render(self):
+        lines = [
+            "# HELP bills_jobs_total Jobs finished by this worker.",
+            "# TYPE bills_jobs_total counter",
+        ]
+        for status, count in sorted(self.jobs.items()):
+            lines.append(f"bills_jobs_total{self._labels(status=status)} {count}")
+
+        for name, help_text in (("queries", "Database queries issued by jobs."),
+                                ("query_seconds", "Time jobs spent in database queries."),
+                                ("rows_inserted", "vnd_bill_dates rows inserted."),
+                                ("duplicates_skipped", "Generated dates skipped as duplicates.")):
+            lines.append(f"# HELP bills_{name}_total {help_text}")
+            lines.append(f"# TYPE bills_{name}_total counter")
+            lines.append(f"bills_{name}_total{self._labels()} {self.counters[name]}")
+
+        lines.append("# HELP bills_phase_seconds_total Time spent per job phase.")
+        lines.append("# TYPE bills_phase_seconds_total counter")
+        for phase, seconds in sorted(self.phase_seconds.items()):
+            lines.append(f"bills_phase_seconds_total{self._labels(phase=phase)} {seconds}")
+
+        lines.append("# HELP bills_job_duration_seconds Job wall time.")
+        lines.append("# TYPE bills_job_duration_seconds histogram")
+        for bound, count in zip(LATENCY_BUCKETS, self.bucket_counts):
+            lines.append(f"bills_job_duration_seconds_bucket{self._labels(le=bound)} {count}")
+        lines.append(f"bills_job_duration_seconds_bucket{self._labels(le='+Inf')} {self.duration_count}")
+        lines.append(f"bills_job_duration_seconds_sum{self._labels()} {self.duration_sum}")
+        lines.append(f"bills_job_duration_seconds_count{self._labels()} {self.duration_count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Atomically replace the textfile so node_exporter never reads a partial file"""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,94 @@
+"""
+Leases on claimed date_job rows.
+
+A worker claims jobs under its worker id with a lease of LEASE_SECONDS.
+A heartbeat thread renews the leases of every job the worker holds
+(claimed, running or being cancelled) every HEARTBEAT_INTERVAL seconds
+while the process is alive, on a connection of its own so a busy job pool
+can't delay a renewal. If a worker or its host dies, its leases run out,
+and any worker's heartbeat thread reaps them. The job goes back to
+'pending', or to 'error' once it has been claimed MAX_ATTEMPTS times.
+"""
+import os
+import socket
+import threading
+import time
+
+from log_setup import get_logger
+
+LEASE_SECONDS = int(os.environ.get("BILLS_LEASE_SECONDS", "60"))
+HEARTBEAT_INTERVAL = LEASE_SECONDS / 3
+
+# Claims per job before an expired lease fails it instead of requeueing it
+MAX_ATTEMPTS = int(os.environ.get("BILLS_MAX_ATTEMPTS", "3"))
+
+log = get_logger("leases")
+
+
+def worker_id():
+    """Identify this worker process across hosts"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def renew_leases(db, owner, lease_seconds=LEASE_SECONDS):
+    """Extend the lease of every job held by owner; returns the number renewed"""
+    cursor = db.cursor()
+    cursor.execute("""UPDATE date_job SET lease_expires_at = NOW() + INTERVAL %s SECOND
+                      WHERE worker_id = %s AND status IN ('running', 'cancelling')""",
+                   (lease_seconds, owner))
+    renewed = cursor.rowcount
+    db.commit()
+    cursor.close()
+    return renewed
+
+
+def reap_expired_leases(db, max_attempts=MAX_ATTEMPTS):
+    """Requeue or fail jobs whose lease ran out; returns (requeued, failed)"""
+    cursor = db.cursor()
+    cursor.execute("""UPDATE date_job
+                      SET status = IF(status = 'cancelling', 'cancelled', 'error'),
+                          output = CONCAT(COALESCE(output, ''), %s)
+                      WHERE status IN ('running', 'cancelling') AND lease_expires_at < NOW()
+                      AND (attempts >= %s OR status = 'cancelling')""",
+                   (f"\nLease of worker expired, giving up after {max_attempts} attempts", max_attempts))
+    failed = cursor.rowcount
+    cursor.execute("""UPDATE date_job
+                      SET status = 'pending', worker_id = NULL, claimed_by = NULL, lease_expires_at = NULL
+                      WHERE status = 'running' AND lease_expires_at < NOW()""")
+    requeued = cursor.rowcount
+    db.commit()
+    cursor.close()
+    return requeued, failed
+
+
+def run_heartbeat(connect, owner, interval=HEARTBEAT_INTERVAL):
+    """Renew owner's leases and reap expired ones every interval seconds, forever
+
+    connect() opens the heartbeat's dedicated connection; it is reopened
+    after any failure.
+    """
+    db = None
+    while True:
+        try:
+            if db is None:
+                db = connect()
+            renew_leases(db, owner)
+            requeued, failed = reap_expired_leases(db)
+            if requeued or failed:
+                log.warning("Expired leases: %s jobs requeued, %s failed", requeued, failed)
+        except Exception:
+            log.exception("Lease heartbeat failed")
+            if db is not None:
+                try:
+                    db.close()
+                except Exception:
+                    pass
+                db = None
+        time.sleep(interval)
+
+
+def start_heartbeat(connect, owner, interval=HEARTBEAT_INTERVAL):
+    thread = threading.Thread(target=run_heartbeat, args=(connect, owner, interval),
+                              name="lease-heartbeat", daemon=True)
+    thread.start()
+    return thread
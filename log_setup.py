@@ -0,0 +1,136 @@
+"""
+Logging for the worker and the Bills class.
+
+Modules log through loggers under "bills". setup_logging() puts a
+QueueHandler on that logger, so a log call just enqueues the record; a
+QueueListener thread formats it and writes it to stderr (the journal
+under systemd). Lines are "time level logger message"
+followed by any extra fields as key=value, or JSON objects with
+BILLS_LOG_FORMAT=json. Repeated warnings are rate-limited per message
+template. job_trace() turns on per-bill DEBUG tracing for one job.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from contextlib import contextmanager
+
+LOG_LEVEL = os.environ.get("BILLS_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("BILLS_LOG_FORMAT", "text")
+
+# Each warning template may be logged RATE_LIMIT_BURST times per RATE_LIMIT_WINDOW seconds
+RATE_LIMIT_BURST = 5
+RATE_LIMIT_WINDOW = 60.0
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+_listener_pid = None
+
+
+def get_logger(name):
+    return logging.getLogger(f"bills.{name}")
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, as_json=False):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+        self.as_json = as_json
+
+    def format(self, record):
+        extra = {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS}
+        if self.as_json:
+            entry = {"time": self.formatTime(record), "level": record.levelname,
+                     "logger": record.name, "message": record.getMessage()}
+            entry.update(extra)
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        line = super().format(record)
+        if extra:
+            line += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+        return line
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock prepare() formats the message in the logging thread so the
+    record can be pickled; this queue never leaves the process.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """Let each WARNING+ message template through burst times per window, counting the rest"""
+
+    def __init__(self, burst=RATE_LIMIT_BURST, window=RATE_LIMIT_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        # (logger, template) -> [window start, records allowed, records suppressed]
+        self.seen = {}
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        state = self.seen.get(key)
+        if state is None or now - state[0] >= self.window:
+            suppressed = state[2] if state else 0
+            self.seen[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if state[1] < self.burst:
+            state[1] += 1
+            return True
+        state[2] += 1
+        return False
+
+
+def setup_logging(level=LOG_LEVEL, stream=None):
+    """Route "bills" loggers through a queue to a background writer (once per process)"""
+    global _listener, _listener_pid
+    if _listener_pid == os.getpid():
+        return _listener
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(StructuredFormatter(as_json=LOG_FORMAT == "json"))
+    listener = logging.handlers.QueueListener(queue.SimpleQueue(), handler)
+
+    queue_handler = DeferredQueueHandler(listener.queue)
+    queue_handler.addFilter(RateLimitFilter())
+    logger = logging.getLogger("bills")
+    # A forked worker inherits its parent's handler, whose listener thread isn't running here
+    for old in list(logger.handlers):
+        logger.removeHandler(old)
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    listener.start()
+    _listener, _listener_pid = listener, os.getpid()
+    return listener
+
+
+@contextmanager
+def job_trace(enabled):
+    """Log "bills" DEBUG records (per-bill tracing) for the duration of one job"""
+    if not enabled:
+        yield
+        return
+    logger = logging.getLogger("bills")
+    previous = logger.level
+    logger.setLevel(logging.DEBUG)
+    try:
+        yield
+    finally:
+        logger.setLevel(previous)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Scheduled maintenance run by the worker outside of generation jobs.
+
+delete_expired_once_bills removes 'Once' bills whose date is more than
+two days past. The predicate compares vnd_frequency_value directly
+against a cutoff string, so the (vnd_frequency, vnd_frequency_value)
+index can serve it, and rows are deleted in primary-key chunks with a
+pause between them, so no table-wide lock is held. Worker 0 runs every
+task in MAINTENANCE_TASKS in a background thread every
+MAINTENANCE_INTERVAL seconds; python maintenance.py runs them once.
+"""
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+from db_pool import connect
+from job_archive import archive_finished_jobs
+from log_setup import get_logger, setup_logging
+
+# Seconds between background maintenance runs
+MAINTENANCE_INTERVAL = int(os.environ.get("BILLS_MAINTENANCE_INTERVAL", "3600"))
+
+# vnd_bills rows deleted per transaction, and the pause between transactions
+DELETE_CHUNK_SIZE = 500
+DELETE_PAUSE = 0.1
+
+log = get_logger("maintenance")
+
+
+def delete_expired_once_bills(db, chunk_size=DELETE_CHUNK_SIZE, pause=DELETE_PAUSE, today=None):
+    """Delete 'Once' bills dated more than two days ago; returns the number deleted
+
+    Same rows as the old DATE_SUB(NOW(), INTERVAL 2 DAY) > DATE(vnd_frequency_value):
+    every date before yesterday. Values are 'YYYY-MM-DD[ HH:MM:SS]' strings, so
+    a string comparison with the cutoff date is equivalent; values in any
+    other format (which DATE() turned into NULL) are still left alone.
+    """
+    cutoff = ((today or date.today()) - timedelta(days=1)).isoformat()
+    cursor = db.cursor()
+    deleted = 0
+    while True:
+        cursor.execute("""SELECT vnd_id FROM vnd_bills
+                          WHERE vnd_frequency = 'Once'
+                          AND vnd_frequency_value < %s
+                          AND vnd_frequency_value LIKE '____-__-__%'
+                          LIMIT %s""", (cutoff, chunk_size))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            db.commit()
+            break
+
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(f"DELETE FROM vnd_bills WHERE vnd_id IN ({placeholders})", ids)
+        db.commit()
+        deleted += len(ids)
+        if len(ids) < chunk_size:
+            break
+        time.sleep(pause)
+
+    cursor.close()
+    return deleted
+
+
+# (description, task); each task takes a connection and returns a row count
+MAINTENANCE_TASKS = [
+    ("expired 'Once' bills deleted", delete_expired_once_bills),
+    ("finished jobs archived to date_job_history", archive_finished_jobs),
+]
+
+
+def run_maintenance(db, tasks=MAINTENANCE_TASKS):
+    """Run every task once, reporting how many rows each one touched"""
+    results = {}
+    for description, task in tasks:
+        results[description] = count = task(db)
+        log.info("Maintenance: %s %s", count, description)
+    return results
+
+
+def run_periodically(connection_factory, interval=MAINTENANCE_INTERVAL, tasks=MAINTENANCE_TASKS):
+    """Run the tasks forever on a connection from connection_factory() every interval seconds"""
+    while True:
+        try:
+            with connection_factory() as db:
+                run_maintenance(db, tasks)
+        except Exception:
+            log.exception("Maintenance failed")
+        time.sleep(interval)
+
+
+def start_maintenance(connection_factory, interval=MAINTENANCE_INTERVAL, tasks=MAINTENANCE_TASKS):
+    thread = threading.Thread(target=run_periodically, args=(connection_factory, interval, tasks),
+                              name="maintenance", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    setup_logging()
+    db = connect()
+    run_maintenance(db)
+    db.close()
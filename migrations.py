@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Schema migrations for the bills worker tables
+Usage: python migrations.py
+"""
+import mysql.connector
+
+MIGRATIONS = [
+    ("001_bill_dates_unique_key", [
+        # Drop duplicate rows left by the old check-then-insert path first
+        """DELETE d1 FROM vnd_bill_dates d1
+           JOIN vnd_bill_dates d2
+             ON d1.vnd_user_id = d2.vnd_user_id
+            AND d1.vnd_bill_desc = d2.vnd_bill_desc
+            AND d1.vnd_date = d2.vnd_date
+            AND d1.vnd_id > d2.vnd_id""",
+        """ALTER TABLE vnd_bill_dates
+           ADD UNIQUE KEY uq_bill_date (vnd_user_id, vnd_bill_desc, vnd_date)""",
+    ]),
+    ("002_date_job_metrics", [
+        "ALTER TABLE date_job ADD COLUMN metrics JSON NULL",
+    ]),
+    ("003_bill_forecast", [
+        """CREATE TABLE IF NOT EXISTS vnd_bill_forecast (
+               vnd_user_id INT NOT NULL,
+               period_start DATE NOT NULL,
+               period_end DATE NOT NULL,
+               total DECIMAL(12, 2) NOT NULL,
+               num_bills INT NOT NULL,
+               has_heavy TINYINT(1) NOT NULL DEFAULT 0,
+               has_future TINYINT(1) NOT NULL DEFAULT 0,
+               PRIMARY KEY (vnd_user_id, period_end)
+           )""",
+    ]),
+    ("004_date_job_status", [
+        # Free-form status for 'cancelling'/'cancelled'
+        "ALTER TABLE date_job MODIFY COLUMN status VARCHAR(20) NOT NULL DEFAULT 'pending'",
+    ]),
+    ("005_date_job_claiming", [
+        # claimed_by tags a batch claim
+        "ALTER TABLE date_job ADD COLUMN claimed_by VARCHAR(64) NULL",
+        "ALTER TABLE date_job ADD INDEX idx_status_created (status, created_at)",
+        "ALTER TABLE date_job ADD INDEX idx_claimed_by (claimed_by)",
+    ]),
+    ("006_date_job_history", [
+        # Same columns as date_job; later date_job columns must be added to both tables
+        "CREATE TABLE IF NOT EXISTS date_job_history LIKE date_job",
+    ]),
+    ("007_bills_frequency_value_index", [
+        # Serves maintenance.delete_expired_once_bills; the prefix covers 'YYYY-MM-DD HH:MM:SS'
+        "ALTER TABLE vnd_bills ADD INDEX idx_frequency_value (vnd_frequency, vnd_frequency_value(19))",
+    ]),
+    ("008_date_job_leases", [
+        """ALTER TABLE date_job
+           ADD COLUMN worker_id VARCHAR(100) NULL,
+           ADD COLUMN lease_expires_at DATETIME NULL,
+           ADD COLUMN attempts INT NOT NULL DEFAULT 0,
+           ADD COLUMN user_id INT NULL,
+           ADD INDEX idx_status_lease (status, lease_expires_at)""",
+        """ALTER TABLE date_job_history
+           ADD COLUMN worker_id VARCHAR(100) NULL,
+           ADD COLUMN lease_expires_at DATETIME NULL,
+           ADD COLUMN attempts INT NOT NULL DEFAULT 0,
+           ADD COLUMN user_id INT NULL""",
+    ]),
+    ("009_date_job_priority", [
+        """ALTER TABLE date_job
+           ADD COLUMN priority INT NOT NULL DEFAULT 0,
+           ADD COLUMN deadline DATETIME NULL,
+           ADD INDEX idx_status_user (status, user_id)""",
+        """ALTER TABLE date_job_history
+           ADD COLUMN priority INT NOT NULL DEFAULT 0,
+           ADD COLUMN deadline DATETIME NULL""",
+    ]),
+    ("010_bill_dates_bill_id", [
+        # Lets a bill-scoped job find its rows after the bill is renamed or deleted
+        """ALTER TABLE vnd_bill_dates
+           ADD COLUMN vnd_bill_id INT NULL,
+           ADD INDEX idx_bill_id (vnd_bill_id)""",
+    ]),
+    ("011_bill_dates_version", [
+        # Bumped whenever a user's vnd_bill_dates change (vnd_user_id 0: every user's), see pay_period_cache.py
+        """CREATE TABLE IF NOT EXISTS vnd_bill_dates_version (
+               vnd_user_id INT NOT NULL PRIMARY KEY,
+               version BIGINT NOT NULL DEFAULT 0
+           )""",
+    ]),
+]
+
+
+def migrate(db):
+    """Apply every migration not yet recorded in schema_migrations"""
+    cursor = db.cursor()
+    cursor.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                          name VARCHAR(100) PRIMARY KEY,
+                          applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                      )""")
+    cursor.execute("SELECT name FROM schema_migrations")
+    applied = {row[0] for row in cursor.fetchall()}
+
+    ran = []
+    for name, statements in MIGRATIONS:
+        if name in applied:
+            continue
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+        db.commit()
+        ran.append(name)
+
+    cursor.close()
+    return ran
+
+
+if __name__ == "__main__":
+    db = mysql.connector.connect(
+        host="localhost",
+        user="",
+        password="",
+        database=""
+    )
+    ran = migrate(db)
+    if ran:
+        for name in ran:
+            print(f"Applied migration: {name}")
+    else:
+        print("Schema is up to date")
+    db.close()
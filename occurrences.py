@@ -0,0 +1,63 @@
+"""
+Lazy, date-ordered bill occurrences computed straight from compiled rules.
+
+BillOccurrences merges each rule's dates with a heap, so a user's
+occurrences come out in (vnd_date, vnd_bill_desc) order, the same order
+as load_bill_dates_by_user_id, without a vnd_bill_dates table. Rows look
+like vnd_bill_dates rows. Like check_date_exists, the first bill wins when
+two bills land on the same description and date.
+"""
+import heapq
+
+import numpy as np
+
+import recurrence
+
+
+def _rule_dates(index, rule, anchor, num_reps):
+    """Yield (date, bill_desc, rule index, rule) for one rule in date order"""
+    dates = np.unique(rule.occurrences(anchor, num_reps))
+    for day in dates.astype(object):
+        yield day, rule.bill_desc, index, rule
+
+
+def _to_date(value):
+    """Convert a window bound (date, datetime or pay period string) to datetime.date"""
+    return recurrence.to_anchor(value).astype(object)
+
+
+class BillOccurrences:
+    def __init__(self, rules, user_id, anchor, num_reps):
+        self.rules = rules
+        self.user_id = user_id
+        self.anchor = anchor
+        self.num_reps = num_reps
+
+    def __iter__(self):
+        streams = [_rule_dates(index, rule, self.anchor, self.num_reps)
+                   for index, rule in enumerate(self.rules)]
+        last_key = None
+        for day, bill_desc, _, rule in heapq.merge(*streams, key=lambda item: item[:3]):
+            if (day, bill_desc) == last_key:
+                continue
+            last_key = (day, bill_desc)
+            yield {
+                'vnd_bill_desc': bill_desc,
+                'vnd_user_id': self.user_id,
+                'vnd_amount': rule.amount,
+                'vnd_date': day,
+                'vnd_is_future': rule.is_future,
+                'is_heavy': rule.is_heavy,
+                'vnd_frequency': rule.frequency.label,
+                'vnd_frequency_type': rule.frequency_type,
+            }
+
+    def between(self, start, end):
+        """Yield occurrences from start to end (inclusive), stopping once end is passed"""
+        start = _to_date(start)
+        end = _to_date(end)
+        for row in self:
+            if row['vnd_date'] > end:
+                return
+            if row['vnd_date'] >= start:
+                yield row
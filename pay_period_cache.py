@@ -0,0 +1,138 @@
+"""
+In-process cache of pay-period bill dates.
+
+load_bill_dates_by_user_id only changes when the user's dates are
+regenerated or the pay period rolls over. PayPeriodCache keeps its
+results keyed by (user_id, next_pay_day). Entries are evicted least
+recently used first once their estimated size passes max_bytes, and
+every entry of an older pay period is dropped as soon as a read for a
+newer one comes in.
+
+Regeneration usually runs in another process (the worker) than the
+reads, so every change to a user's vnd_bill_dates also bumps that user's
+row in vnd_bill_dates_version, in the same transaction (vnd_user_id
+ALL_USERS for whole-table rebuilds). Entries remember the version they
+were read at. A read within VERSION_TTL seconds of an entry's last
+version check is answered without touching MySQL; after that the
+version (a primary key lookup) is checked again, and the pay period is
+only queried again if it changed. A regeneration in another process is
+therefore seen within VERSION_TTL seconds.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Estimated bytes of cached rows kept before the least recently used users are dropped
+MAX_CACHE_BYTES = int(os.environ.get("BILLS_PAY_PERIOD_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Seconds a cached entry is trusted before its version is checked again
+VERSION_TTL = float(os.environ.get("BILLS_PAY_PERIOD_VERSION_TTL", "5"))
+
+# vnd_bill_dates_version row bumped when every user's dates change
+ALL_USERS = 0
+
+
+def _rows_size(rows):
+    """Rough in-memory size of a list of row dicts"""
+    return sys.getsizeof(rows) + sum(
+        sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values()) for row in rows)
+
+
+def read_version(cursor, user_id):
+    """Current version of a user's stored dates (their own bumps plus ALL_USERS bumps)"""
+    cursor.execute("""SELECT COALESCE(SUM(version), 0) AS version FROM vnd_bill_dates_version
+                      WHERE vnd_user_id IN (%s, %s)""", (ALL_USERS, user_id))
+    row = cursor.fetchone()
+    return int(row['version'] if isinstance(row, dict) else row[0])
+
+
+def bump_version(cursor, user_id):
+    """Mark user_id's dates (everyone's with ALL_USERS) as changed; commit it with the change"""
+    cursor.execute("""INSERT INTO vnd_bill_dates_version (vnd_user_id, version) VALUES (%s, 1)
+                      ON DUPLICATE KEY UPDATE version = version + 1""", (user_id,))
+
+
+class PayPeriodCache:
+    def __init__(self, max_bytes=MAX_CACHE_BYTES, version_ttl=VERSION_TTL):
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        # (user_id, next_pay_day) -> [rows, size, version, last version check]
+        self.entries = OrderedDict()
+        self.size = 0
+        self.period = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _roll_over(self, next_pay_day):
+        """Drop every entry of an earlier pay period once a later one is read"""
+        if self.period is not None and next_pay_day <= self.period:
+            return
+        self.period = next_pay_day
+        for key in [key for key in self.entries if key[1] < next_pay_day]:
+            self.size -= self.entries.pop(key)[1]
+
+    def _entry(self, key, read_version):
+        """The entry for key, dropped if its version check is due and read_version() has moved on"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or read_version is None or time.monotonic() - entry[3] < self.version_ttl:
+                return entry
+        # Query outside the lock so other users' reads aren't held up
+        version = read_version()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] != version:
+                self.size -= self.entries.pop(key)[1]
+                return None
+            if entry is not None:
+                entry[3] = time.monotonic()
+            return entry
+
+    def get(self, user_id, next_pay_day, read_version=None):
+        """Cached rows for the user's pay period, or None
+
+        read_version() returns the user's current version; it is only
+        called once the entry's last check is version_ttl seconds old.
+        """
+        key = (user_id, next_pay_day)
+        with self.lock:
+            self._roll_over(next_pay_day)
+        entry = self._entry(key, read_version)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id, next_pay_day, rows, version=None):
+        size = _rows_size(rows)
+        with self.lock:
+            if size > self.max_bytes:
+                return
+            key = (user_id, next_pay_day)
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = [rows, size, version, time.monotonic()]
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == user_id]:
+                self.size -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+# Shared by every Bills instance in the process, like RULE_CACHE
+PAY_PERIOD_CACHE = PayPeriodCache()
@@ -0,0 +1,133 @@
+"""
+Pipelined bill date generation.
+
+Three threads are linked by bounded queues. A reader streams vnd_bills
+rows, a compute stage turns each into occurrence dates, and a writer
+flushes them in INSERT IGNORE batches on its own connection. MySQL round
+trips on the read and write sides overlap with date computation, and the
+bounded queues apply backpressure so memory stays flat however many bills
+are streamed.
+"""
+import queue
+import threading
+
+from bill_writer import BillDateWriter
+from log_setup import get_logger
+from pay_period_cache import bump_version
+
+# Items buffered between stages
+QUEUE_SIZE = 256
+
+_DONE = object()
+
+log = get_logger("pipeline")
+
+
+class GenerationPipeline:
+    def __init__(self, bills, read_connection, batch_size, queue_size=QUEUE_SIZE):
+        """bills supplies the write connection, rule cache, pay period, date span and metrics"""
+        self.bills = bills
+        self.read_connection = read_connection
+        self.batch_size = batch_size
+        self.bill_queue = queue.Queue(queue_size)
+        self.date_queue = queue.Queue(queue_size)
+        self.failed = threading.Event()
+        self.errors = []
+        self.num_users = 0
+
+    def _put(self, target, item):
+        """Block until there is room, giving up if another stage failed"""
+        while not self.failed.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source):
+        while not self.failed.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _stage(self, func, *args):
+        """Run a stage, recording its exception and stopping the others"""
+        try:
+            func(*args)
+        except Exception as e:
+            self.errors.append(e)
+            self.failed.set()
+
+    def _read(self, query, params):
+        stream = self.read_connection.cursor(dictionary=True, buffered=False)
+        stream.execute(query, params)
+        for bill in stream:
+            if not self._put(self.bill_queue, bill):
+                break
+        stream.close()
+        self._put(self.bill_queue, _DONE)
+
+    def _compute(self):
+        bills = self.bills
+        while True:
+            bill = self._get(self.bill_queue)
+            if bill is _DONE:
+                break
+            frequency = bill['vnd_frequency']
+            bills.metrics.bills_by_frequency[frequency] += 1
+            try:
+                rule = bills.rules.get(bill)
+                dates = bills.rule_dates(rule)
+            except ValueError as e:
+                log.warning("%s for bill '%s', skipping", e, bill.get('vnd_bill', 'Unknown'))
+                continue
+            except Exception:
+                # Like Bills.generate_bill_dates, one bad bill doesn't stop the job
+                log.exception("Error processing bill %s (freq: %s)", bill.get('vnd_bill', 'Unknown'), frequency)
+                continue
+            if not self._put(self.date_queue, (bill['vnd_user_id'], bill.get('vnd_id'), rule, dates)):
+                return
+        self._put(self.date_queue, _DONE)
+
+    def _commit_user(self, db, writer, user_id):
+        writer.flush()
+        if user_id is not None:
+            bump_version(writer.cursor, user_id)
+        db.commit()
+
+    def _write(self):
+        db = self.bills.db
+        writer = BillDateWriter(db, self.batch_size, self.bills.metrics)
+        current_user = None
+        while True:
+            item = self._get(self.date_queue)
+            if item is _DONE:
+                break
+            user_id, bill_id, rule, dates = item
+            if user_id != current_user:
+                # Commit each user's dates as soon as the next user starts
+                self._commit_user(db, writer, current_user)
+                current_user = user_id
+                self.num_users += 1
+            writer.add_dates(dates, rule.bill_desc, user_id, rule.amount, rule.is_future,
+                             rule.is_heavy, rule.frequency.label, rule.frequency_type, bill_id)
+        if not self.failed.is_set():
+            self._commit_user(db, writer, current_user)
+
+    def run(self, query, params=()):
+        """Stream the bills selected by query through the pipeline; returns the number of users"""
+        threads = [
+            threading.Thread(target=self._stage, args=(self._read, query, params), name="bills-reader"),
+            threading.Thread(target=self._stage, args=(self._compute,), name="bills-compute"),
+            threading.Thread(target=self._stage, args=(self._write,), name="bills-writer"),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+        return self.num_users
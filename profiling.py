@@ -0,0 +1,66 @@
+"""
+Opt-in cProfile profiling of single jobs.
+
+A job whose JSON payload has "profile": true runs inside profiled().
+The raw profile goes to PROFILE_DIR/job_<id>.prof (open it with pstats or
+snakeviz), and a text summary of the top PROFILE_TOP_N functions goes to
+job_<id>.txt. The summary starts with the job's wall time and the part of
+it spent waiting on the database, taken from the job's JobMetrics. Jobs
+without the flag never touch this module.
+"""
+import cProfile
+import io
+import os
+import pstats
+from contextlib import contextmanager
+
+PROFILE_DIR = os.environ.get("BILLS_PROFILE_DIR", "/tmp/bills_profiles")
+
+# Functions listed in the text summary
+PROFILE_TOP_N = 25
+
+
+class JobProfile:
+    def __init__(self, job_id, profile_dir=PROFILE_DIR):
+        self.dump_path = os.path.join(profile_dir, f"job_{job_id}.prof")
+        self.summary_path = os.path.join(profile_dir, f"job_{job_id}.txt")
+
+    def write(self, profiler, metrics, top_n=PROFILE_TOP_N):
+        os.makedirs(os.path.dirname(self.dump_path), exist_ok=True)
+        profiler.dump_stats(self.dump_path)
+
+        wall = metrics.wall_seconds or 0.0
+        report = io.StringIO()
+        report.write(f"Wall time: {wall:.3f}s\n")
+        report.write(f"Database wait: {metrics.query_seconds:.3f}s over {metrics.queries} queries\n")
+        report.write(f"Everything else: {max(wall - metrics.query_seconds, 0.0):.3f}s\n")
+        for phase, seconds in metrics.phases.most_common():
+            report.write(f"  {phase}: {seconds:.3f}s\n")
+        report.write("\n")
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top_n)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(top_n)
+        with open(self.summary_path, "w") as f:
+            f.write(report.getvalue())
+
+    def __str__(self):
+        return f"Profile written to {self.dump_path} (summary: {self.summary_path})"
+
+
+@contextmanager
+def profiled(job_id, metrics, profile_dir=PROFILE_DIR):
+    """Profile the with block, then write the dump and summary for job_id
+
+    metrics.finish() is called before the summary is written so the wall
+    time covers the profiled work.
+    """
+    profile = JobProfile(job_id, profile_dir)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profile
+    finally:
+        profiler.disable()
+        metrics.finish()
+        metrics.profile = profile.dump_path
+        profile.write(profiler, metrics)
@@ -5,6 +5,7 @@ Simple script to add a bill generation job to the queue
 import mysql.connector
 import json
 from datetime import datetime
+from wakeup import notify_worker
 
 try:
     # Connect to database
@@ -24,6 +25,7 @@ try:
     query = "INSERT INTO date_job (command, status, created_at) VALUES (%s, %s, %s)"
     cursor.execute(query, (command, 'pending', datetime.now()))
     db.commit()
+    notify_worker()
     
     job_id = cursor.lastrowid
     print(f"✓ Job added successfully with ID: {job_id}")
@@ -0,0 +1,209 @@
+"""
+Non-blocking execution of shell-command jobs.
+
+ShellJobRunner runs each command in its own process group on a small
+thread pool, so a long shell job doesn't hold up the generation jobs
+queued behind it. Output is streamed into date_job.output every few
+seconds. Once it passes OUTPUT_CAP_CHARS the full output is spilled to a
+file, and the row keeps the head and the file's path. Setting a running
+job's status to 'cancelling' kills it, as does passing SHELL_JOB_TIMEOUT.
+"""
+import os
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from job_metrics import JobMetrics
+from log_setup import get_logger
+
+# Shell jobs run at once per worker process
+SHELL_JOB_SLOTS = int(os.environ.get("BILLS_SHELL_JOB_SLOTS", "2"))
+
+# Seconds before a shell job is killed, as the old subprocess.run timeout
+SHELL_JOB_TIMEOUT = int(os.environ.get("BILLS_SHELL_JOB_TIMEOUT", "300"))
+
+# Output kept in date_job.output; anything longer goes to a file in SPILL_DIR
+OUTPUT_CAP_CHARS = 64 * 1024
+SPILL_DIR = os.environ.get("BILLS_SHELL_OUTPUT_DIR", "/tmp/bills_job_output")
+
+# Seconds between output flushes and cancellation checks
+FLUSH_INTERVAL = 2.0
+
+log = get_logger("shell_jobs")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobOutput:
+    """Output of one shell job, capped in memory and spilled to a file past the cap"""
+
+    def __init__(self, job_id, cap=OUTPUT_CAP_CHARS, spill_dir=SPILL_DIR):
+        self.job_id = job_id
+        self.cap = cap
+        self.spill_dir = spill_dir
+        self.head = []
+        self.head_size = 0
+        self.size = 0
+        self.spill_path = None
+        self.spill_file = None
+        self.changed = False
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            if self.spill_file is None and self.size + len(text) > self.cap:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                self.spill_path = os.path.join(self.spill_dir, f"job_{self.job_id}.log")
+                self.spill_file = open(self.spill_path, "w")
+                self.spill_file.write("".join(self.head))
+            if self.spill_file is not None:
+                self.spill_file.write(text)
+                if self.head_size < self.cap:
+                    part = text[:self.cap - self.head_size]
+                    self.head.append(part)
+                    self.head_size += len(part)
+            else:
+                self.head.append(text)
+                self.head_size += len(text)
+            self.size += len(text)
+            self.changed = True
+
+    def text(self):
+        with self.lock:
+            text = "".join(self.head)
+            if self.spill_path:
+                text += f"\n... output truncated at {self.cap} of {self.size} characters, full output in {self.spill_path}"
+            return text
+
+    def close(self):
+        with self.lock:
+            if self.spill_file is not None:
+                self.spill_file.close()
+
+
+class ShellJobRunner:
+    def __init__(self, connection_factory=None, slots=SHELL_JOB_SLOTS, timeout=SHELL_JOB_TIMEOUT,
+                 output_cap=OUTPUT_CAP_CHARS, spill_dir=SPILL_DIR, flush_interval=FLUSH_INTERVAL):
+        """connection_factory() returns a context manager yielding a date_job connection
+
+        Without one, output is only returned at the end and jobs can't be
+        cancelled from the queue.
+        """
+        self.connection_factory = connection_factory
+        self.slots = slots
+        self.timeout = timeout
+        self.output_cap = output_cap
+        self.spill_dir = spill_dir
+        self.flush_interval = flush_interval
+        self.executor = ThreadPoolExecutor(max_workers=slots, thread_name_prefix="shell-job")
+        self.running = {}
+
+    def free_slots(self):
+        return max(self.slots - len(self.running), 0)
+
+    def submit(self, job):
+        metrics = JobMetrics()
+        future = self.executor.submit(self._run, job['id'], job['command'], metrics)
+        self.running[job['id']] = (job, future, metrics)
+
+    def finished(self):
+        """Remove finished jobs and return them as (job, status, output, metrics)"""
+        results = []
+        for job_id, (job, future, metrics) in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[job_id]
+            try:
+                output = future.result()
+                status = 'done'
+            except JobCancelled as e:
+                output = str(e)
+                status = 'cancelled'
+            except Exception as e:
+                output = str(e)
+                status = 'error'
+            metrics.finish()
+            results.append((job, status, output, metrics))
+        return results
+
+    def _sync(self, job_id, output):
+        """Write new output to the job row; returns True if the job was asked to cancel"""
+        if self.connection_factory is None:
+            return False
+        with self.connection_factory() as db:
+            cursor = db.cursor()
+            if output.changed:
+                output.changed = False
+                cursor.execute("UPDATE date_job SET output=%s WHERE id=%s", (output.text(), job_id))
+            cursor.execute("SELECT status FROM date_job WHERE id=%s", (job_id,))
+            row = cursor.fetchone()
+            db.commit()
+            cursor.close()
+        return row is not None and row[0] == 'cancelling'
+
+    @staticmethod
+    def _kill(process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    def _pump(stream, output):
+        for line in stream:
+            output.write(line)
+
+    def _run(self, job_id, command, metrics):
+        output = JobOutput(job_id, self.output_cap, self.spill_dir)
+        # Own process group so a cancel also kills the command's children
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   text=True, errors="replace", start_new_session=True)
+        reader = threading.Thread(target=self._pump, args=(process.stdout, output), daemon=True)
+        reader.start()
+
+        deadline = time.monotonic() + self.timeout
+        reason = None
+        try:
+            with metrics.phase("shell"):
+                while reader.is_alive() or process.poll() is None:
+                    reader.join(self.flush_interval)
+                    cancelled = False
+                    try:
+                        with metrics.phase("sync_output"):
+                            cancelled = self._sync(job_id, output)
+                    except Exception:
+                        # A database blip only delays the output; the job keeps running
+                        log.warning("Could not sync output of job %s", job_id, exc_info=True)
+                        output.changed = True
+                    if cancelled:
+                        reason = "cancelled"
+                    elif time.monotonic() > deadline:
+                        reason = f"timed out after {self.timeout} seconds"
+                    if reason:
+                        self._kill(process)
+                        break
+                process.wait()
+                reader.join()
+        finally:
+            # Never leave the command running unwatched, or the reader writing to a closed file
+            if process.poll() is None:
+                self._kill(process)
+                process.wait()
+            reader.join()
+            output.close()
+
+        text = output.text()
+        if reason == "cancelled":
+            raise JobCancelled(f"{text}\nJob cancelled")
+        if reason:
+            raise Exception(f"{text}\nCommand {reason}")
+        if process.returncode != 0:
+            raise Exception(f"{text}\nCommand exited with code {process.returncode}")
+        return text
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
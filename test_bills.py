@@ -4,6 +4,20 @@ Test script to verify the Bills class works correctly
 """
 import mysql.connector
 from bills import Bills
+from bill_rule import BillRule, Frequency, RuleCache
+from occurrences import BillOccurrences
+from forecast import forecast_rules, pay_days
+from shell_jobs import ShellJobRunner
+from bulk_load import BillDateFile
+from log_setup import RateLimitFilter
+from pay_period_cache import PayPeriodCache, bump_version
+from job_metrics import JobMetrics
+from worker import claim_query, covers, generation_scope
+import worker
+import re
+import logging
+import tempfile
+from pathlib import Path
 from datetime import datetime, date
 
 def test_date_conversion():
@@ -37,5 +51,228 @@ def test_date_conversion():
     
     db.close()
 
+def test_existing_dates_index():
+    """check_date_exists answers from the in-memory index once it is loaded"""
+    bill = Bills(10)
+    bill.user_id = 1
+    bill.existing_dates = {("Rent", "2023-09-01")}
+
+    assert bill.check_date_exists("Rent", "2023-09-01", 1)
+    assert not bill.check_date_exists("Rent", "2023-10-01", 1)
+
+def test_bill_rule_dispatch():
+    """Rules are compiled once and generate nothing for a mismatched frequency type"""
+    row = {'vnd_user_id': 1, 'vnd_bill': "Gym", 'amount': 20, 'vnd_frequency': "Every 4 Weeks",
+           'vnd_frequency_value': "2023-01-01", 'vnd_frequency_type': "Starting From"}
+    rule = BillRule.from_row(row)
+    assert rule.frequency is Frequency.EVERY_4_WEEKS
+    assert str(rule.occurrences(None, 1)[0]) == "2023-01-29"
+
+    rule = BillRule.from_row(dict(row, vnd_frequency_type="Day of Month"))
+    assert len(rule.occurrences(None, 1)) == 0
+
+    for bad in ({'vnd_frequency': "Fortnightly"},
+                {'vnd_frequency': "Once Per Month", 'vnd_frequency_type': "Day of Month",
+                 'vnd_frequency_value': "40"}):
+        try:
+            BillRule.from_row(dict(row, **bad))
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad} should be rejected")
+
+def test_once_value_with_time_suffix():
+    """'Once' dates stored as datetimes still generate their date"""
+    row = {'vnd_bill': "Deposit", 'amount': 50, 'vnd_frequency': "Once",
+           'vnd_frequency_value': "2023-10-15 00:00:00", 'vnd_frequency_type': ""}
+    rule = BillRule.from_row(row)
+    assert [str(day) for day in rule.occurrences("2023-09-20 10:00:00", 10)] == ["2023-10-15"]
+
+def test_rule_cache_reuses_rules():
+    cache = RuleCache(max_rules=1)
+    row = {'vnd_bill': "Rent", 'amount': 900, 'vnd_frequency': "Once Per Month",
+           'vnd_frequency_value': "1", 'vnd_frequency_type': "Day of Month"}
+    assert cache.get(row) is cache.get(dict(row))
+    cache.get(dict(row, amount=950))
+    assert len(cache.rules) == 1 and cache.hits == 1
+
+def test_occurrences_merge_in_date_order():
+    """Occurrences merge across bills by (date, description), skip duplicates and stop at the window end"""
+    rows = [
+        {'vnd_bill': "Rent", 'amount': 900, 'vnd_frequency': "Once Per Month",
+         'vnd_frequency_value': "15", 'vnd_frequency_type': "Day of Month"},
+        {'vnd_bill': "Gym", 'amount': 20, 'vnd_frequency': "Every 2 Weeks",
+         'vnd_frequency_value': "2023-09-01", 'vnd_frequency_type': "Starting From"},
+        {'vnd_bill': "Rent", 'amount': 900, 'vnd_frequency': "Once",
+         'vnd_frequency_value': "2023-10-15", 'vnd_frequency_type': ""},
+    ]
+    occurrences = BillOccurrences([BillRule.from_row(row) for row in rows], 1,
+                                  "2023-09-20 10:00:00", 12)
+    window = [(str(row['vnd_date']), row['vnd_bill_desc'])
+              for row in occurrences.between("2023-09-20 00:00:00", "2023-10-31")]
+    assert window == [("2023-09-29", "Gym"), ("2023-10-13", "Gym"),
+                      ("2023-10-15", "Rent"), ("2023-10-27", "Gym")]
+
+def test_forecast_totals_per_pay_period():
+    """Amounts land in the pay period ending on or after their date"""
+    assert [str(day) for day in pay_days("2023-09-20 10:00:00", 3)] == ["2023-09-30", "2023-10-14", "2023-10-31"]
+    rows = [
+        {'vnd_bill': "Rent", 'amount': 900, 'vnd_frequency': "Once Per Month",
+         'vnd_frequency_value': "1", 'vnd_frequency_type': "Day of Month", 'is_heavy': 1},
+        {'vnd_bill': "Gym", 'amount': 20, 'vnd_frequency': "Every 2 Weeks",
+         'vnd_frequency_value': "2023-09-01", 'vnd_frequency_type': "Starting From"},
+    ]
+    periods = forecast_rules([BillRule.from_row(row) for row in rows], "2023-09-20 10:00:00", 3)
+    assert [(p['total'], p['num_bills'], p['has_heavy']) for p in periods] == \
+        [(20.0, 1, False), (920.0, 2, True), (20.0, 1, False)]
+
+def test_covers_only_absorbs_redundant_jobs():
+    """A user-wide job covers its user's bill jobs; bill jobs without a user_id are never coalesced"""
+    scope = lambda command, test_mode=0: generation_scope({'command': command, 'test_mode': test_mode})
+    user_job = scope('generate_bill_dates:{"user_id": 1}')
+    assert covers(user_job, scope('generate_bill_dates'))
+    assert covers(user_job, scope('generate_bill_dates:{"user_id": 1, "bill_id": 7}'))
+    assert not covers(user_job, scope('generate_bill_dates:{"user_id": 2}'))
+    assert not covers(user_job, scope('generate_bill_dates:{"user_id": 1, "num_reps": 60}'))
+    assert not covers(user_job, scope('generate_bill_dates:{"user_id": 1}', test_mode=1))
+    assert not covers(scope('generate_bill_dates:{"user_id": 1, "bill_id": 7}'), user_job)
+    assert scope('generate_bill_dates:{"bill_id": 7}') is None
+    assert not covers(user_job, scope('generate_bill_dates:{"bill_id": 7}'))
+    assert scope('generate_all_users') is None
+
+def test_claim_query_binds_parameters_in_order():
+    """Each claim parameter lands on its own placeholder, with node routing on or off"""
+    for node_count in (1, 3):
+        sql, params = claim_query(5, "tok", "host:1", node_index=1, node_count=node_count)
+        assert sql.count("%s") == len(params)
+        values = iter(params)
+        bound = re.sub(r"%s", lambda match: repr(next(values)), sql)
+        bound = " ".join(bound.split())
+        assert f"DIV {worker.AGING_SECONDS} AS effective_priority" in bound
+        assert f"HAVING COUNT(*) >= {worker.MAX_RUNNING_PER_USER})" in bound
+        assert f"WHERE user_turn <= {worker.MAX_RUNNING_PER_USER} " in bound
+        assert f"NOW() + INTERVAL {worker.DEADLINE_URGENT_SECONDS} SECOND DESC" in bound
+        assert "LIMIT 5 " in bound and "j.claimed_by='tok', j.worker_id='host:1'" in bound
+        assert f"NOW() + INTERVAL {worker.LEASE_SECONDS} SECOND, j.attempts" in bound
+        routed = f"MOD(user_id, 3) = 1 OR created_at < NOW() - INTERVAL {worker.ROUTE_GRACE_SECONDS} SECOND"
+        assert (routed in bound) == (node_count > 1)
+
+def test_job_metrics_finish_once():
+    """A profiled job's wall time is the one measured first, whoever calls finish() again"""
+    metrics = JobMetrics()
+    metrics.finish()
+    first = metrics.wall_seconds
+    metrics.finish()
+    assert metrics.wall_seconds == first
+
+def test_shell_job_output_spills_past_cap(tmp_path):
+    """Shell jobs run in the background and keep only the head of long output"""
+    runner = ShellJobRunner(output_cap=100, spill_dir=str(tmp_path), flush_interval=0.05)
+    runner.submit({'id': 1, 'command': "seq 1 1000"})
+    runner.submit({'id': 2, 'command': "echo failed; exit 3"})
+    runner.shutdown()
+    results = {job['id']: (status, output) for job, status, output, _ in runner.finished()}
+    status, output = results[1]
+    assert status == 'done' and output.startswith("1\n2\n") and "full output in" in output
+    with open(tmp_path / "job_1.log") as f:
+        assert f.read().splitlines()[-1] == "1000"
+    assert results[2][0] == 'error' and "exited with code 3" in results[2][1]
+
+def test_bill_date_file_escapes_and_dedups(tmp_path):
+    """TSV rows use LOAD DATA escaping and repeat a description/date only once per user"""
+    path = str(tmp_path / "dates.tsv")
+    with BillDateFile(path) as out:
+        out.add("Rent\tflat", 1, 900, "2023-10-01", is_future=None)
+        out.add("Rent\tflat", 1, 900, "2023-10-01")
+        out.add("Rent\tflat", 2, 900, "2023-10-01")
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert out.rows_written == 2
+    assert lines[0].split("\t") == ["Rent\\tflat", "1", "900", "2023-10-01", "\\N", "0", "", "", "\\N"]
+
+def test_repeated_warnings_are_rate_limited():
+    """Only the first few warnings per template get through; the next allowed one reports the rest"""
+    limiter = RateLimitFilter(burst=2, window=60)
+    record = lambda: logging.makeLogRecord({"name": "bills.bills", "levelno": logging.WARNING,
+                                            "msg": "%s for bill '%s', skipping"})
+    assert [limiter.filter(record()) for _ in range(5)] == [True, True, False, False, False]
+    limiter.window = 0
+    allowed = record()
+    assert limiter.filter(allowed) and allowed.suppressed == 3
+
+def test_horizon_mode_stops_every_frequency_at_the_same_date():
+    """With horizon_days, weekly and quarterly bills both run from today to today + horizon_days"""
+    bill = Bills(42, horizon_days=60)
+    bill.set_pay_period(today="2023-09-20 10:00:00")
+    rows = [
+        {'vnd_bill': "Gym", 'amount': 20, 'vnd_frequency': "Every 1 Week",
+         'vnd_frequency_value': "2023-09-01", 'vnd_frequency_type': "Starting From"},
+        {'vnd_bill': "Water", 'amount': 90, 'vnd_frequency': "Every 3 Months",
+         'vnd_frequency_value': "2023-08-01", 'vnd_frequency_type': "Starting From"},
+        {'vnd_bill': "Lessons", 'amount': 30, 'vnd_frequency': "Every 1 Week",
+         'vnd_frequency_value': "2012-01-02", 'vnd_frequency_type': "Starting From"},
+    ]
+    weekly, quarterly, old_weekly = (bill.rule_dates(BillRule.from_row(row)) for row in rows)
+    assert str(bill.horizon_end) == "2023-11-19"
+    assert str(weekly[0]) == "2023-09-22" and str(weekly[-1]) == "2023-11-17" and len(weekly) == 9
+    assert [str(day) for day in quarterly] == ["2023-10-30"]
+    # A start date years back doesn't generate the years in between
+    assert str(old_weekly[0]) == "2023-09-25" and str(old_weekly[-1]) == "2023-11-13" and len(old_weekly) == 8
+
+def test_pay_period_cache_invalidation():
+    """Cached pay periods are dropped per user, on a version change, on roll-over and past the memory cap"""
+    cache = PayPeriodCache()
+    rows = [{'vnd_bill_desc': "Rent", 'vnd_date': "2023-09-30"}]
+    cache.put(1, "2023-09-30", rows)
+    cache.put(2, "2023-09-30", rows)
+    assert cache.get(1, "2023-09-30") is rows
+    cache.invalidate_user(1)
+    assert cache.get(1, "2023-09-30") is None and cache.get(2, "2023-09-30") is rows
+    cache.put(1, "2023-09-30", rows, version=3)
+    # Within the TTL the version isn't read at all
+    assert cache.get(1, "2023-09-30", lambda: 1 / 0) is rows
+    cache.version_ttl = 0
+    assert cache.get(1, "2023-09-30", lambda: 3) is rows
+    assert cache.get(1, "2023-09-30", lambda: 4) is None and (1, "2023-09-30") not in cache.entries
+    assert cache.get(2, "2023-10-14") is None and not cache.entries
+    cache.put(1, "2023-10-14", rows)
+    cache.max_bytes = cache.size
+    cache.put(2, "2023-10-14", rows)
+    assert list(cache.entries) == [(2, "2023-10-14")]
+
+def test_pay_period_reads_skip_mysql_within_ttl():
+    """Cached reads run no queries until the TTL, then only refetch after a regeneration"""
+    from benchmark import StandInConnection
+    db = StandInConnection()
+    db.conn.executemany("INSERT INTO vnd_bill_dates (vnd_bill_desc, vnd_user_id, vnd_date) VALUES (?, 1, ?)",
+                        [("Rent", "2023-09-20"), ("Gym", "2023-09-25")])
+    bill = Bills(42, db)
+    bill.pay_periods = PayPeriodCache(version_ttl=60)
+    bill.set_pay_period(today="2023-09-20 10:00:00")
+    first = bill.load_bill_dates_by_user_id(1)
+    # Today's own dates are left out, as before caching
+    assert [row['vnd_bill_desc'] for row in first] == ["Gym"]
+    queries = db.queries
+    assert bill.load_bill_dates_by_user_id(1) == first and db.queries == queries
+    bill.pay_periods.version_ttl = 0
+    assert bill.load_bill_dates_by_user_id(1) and db.queries == queries + 1
+    db.conn.execute("DELETE FROM vnd_bill_dates WHERE vnd_bill_desc = 'Gym'")
+    bump_version(db.cursor(), 1)
+    assert [row['vnd_bill_desc'] for row in bill.load_bill_dates_by_user_id(1)] == []
+
 if __name__ == "__main__":
     test_date_conversion()
+    test_existing_dates_index()
+    test_bill_rule_dispatch()
+    test_once_value_with_time_suffix()
+    test_rule_cache_reuses_rules()
+    test_occurrences_merge_in_date_order()
+    test_forecast_totals_per_pay_period()
+    test_covers_only_absorbs_redundant_jobs()
+    test_claim_query_binds_parameters_in_order()
+    test_job_metrics_finish_once()
+    test_shell_job_output_spills_past_cap(Path(tempfile.mkdtemp()))
+    test_bill_date_file_escapes_and_dedups(Path(tempfile.mkdtemp()))
+    test_repeated_warnings_are_rate_limited()
+    test_horizon_mode_stops_every_frequency_at_the_same_date()
+    test_pay_period_cache_invalidation()
+    test_pay_period_reads_skip_mysql_within_ttl()
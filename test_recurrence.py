@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Tests for the DB-free recurrence engine
+"""
+import numpy as np
+import recurrence
+
+TODAY = "2023-01-10 08:30:00"
+
+
+def days(*values):
+    return np.array(values, dtype="datetime64[D]")
+
+
+def test_once_per_month_clamps_after_february():
+    dates = recurrence.once_per_month(31, TODAY, 4)
+    assert (dates == days("2023-01-31", "2023-02-28", "2023-03-28", "2023-04-28")).all()
+
+
+def test_once_per_month_skips_short_months_and_filters():
+    dates = recurrence.once_per_month(30, "2023-03-01 00:00:00", 4,
+                                      start_date="2023-04-01", end_date="2023-05-30")
+    assert (dates == days("2023-04-30", "2023-05-30")).all()
+
+
+def test_once_per_week_skips_first_upcoming_day():
+    # 2023-01-10 is a Tuesday; PHP weekday 5 is Friday
+    dates = recurrence.once_per_week("5", TODAY, 2)
+    assert (dates == days("2023-01-20", "2023-01-27")).all()
+
+
+def test_every_x_steps_from_start():
+    assert (recurrence.every_x_months("2023-01-01", 3, 2) == days("2023-04-01", "2023-06-30")).all()
+    assert (recurrence.every_x_weeks("2023-01-01", 2, 2) == days("2023-01-15", "2023-01-29")).all()
+
+
+def test_invalid_values_raise():
+    for value in ("", "abc", 32):
+        try:
+            recurrence.once_per_month(value, TODAY, 1)
+        except ValueError:
+            continue
+        raise AssertionError(f"{value!r} should be rejected")
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name}: ok")
@@ -0,0 +1,61 @@
+"""
+Local wake-up signal for idle workers.
+
+Idle workers wait on a UNIX datagram socket between queue polls. The
+enqueue scripts send a datagram right after inserting a job, so the job
+starts immediately instead of after the current poll interval. Signals
+are best effort: with no worker listening the job is still picked up by
+the next poll.
+"""
+import os
+import select
+import socket
+import time
+
+from log_setup import get_logger
+
+WAKEUP_SOCKET = os.environ.get("BILLS_WAKEUP_SOCKET", "/tmp/bills_worker.sock")
+
+log = get_logger("wakeup")
+
+
+def open_wakeup_socket(path=WAKEUP_SOCKET):
+    """Bind the worker side of the wake-up socket (None if it can't be bound)"""
+    try:
+        if os.path.exists(path):
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        sock.setblocking(False)
+        return sock
+    except OSError as e:
+        log.warning("Wake-up socket %s unavailable (%s), polling only", path, e)
+        return None
+
+
+def wait_for_wakeup(sock, timeout):
+    """Sleep up to timeout seconds; return True early if a job was signalled"""
+    if sock is None:
+        time.sleep(timeout)
+        return False
+
+    readable, _, _ = select.select([sock], [], [], timeout)
+    if not readable:
+        return False
+
+    # Drain queued signals so a burst of enqueues causes a single wake-up
+    try:
+        while True:
+            sock.recv(64)
+    except (BlockingIOError, InterruptedError):
+        pass
+    return True
+
+
+def notify_worker(path=WAKEUP_SOCKET):
+    """Wake an idle worker after queuing a job; does nothing if none is listening"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b"job", path)
+    except OSError:
+        pass
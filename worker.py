@@ -1,14 +1,49 @@
 import time
-print("Worker started at", time.strftime("%Y-%m-%d %H:%M:%S"))
-
-import time
-import subprocess
 import mysql.connector
 import json
+import uuid
 from bills import Bills
+from bill_writer import DEFAULT_CHUNK_SIZE
+from bulk_load import BillDateFile, bulk_file_path, load_bill_dates_file
+from db_pool import ConnectionManager, connect
+from pay_period_cache import ALL_USERS, bump_version
+from wakeup import open_wakeup_socket, wait_for_wakeup
+from job_metrics import InstrumentedConnection, JobMetrics, PrometheusTextfile
+from profiling import profiled
+from log_setup import get_logger, job_trace, setup_logging
+from leases import LEASE_SECONDS, start_heartbeat, worker_id
+from shell_jobs import FLUSH_INTERVAL, ShellJobRunner
+from maintenance import start_maintenance
 
 import os
+import sys
 import time
+import multiprocessing
+
+# Number of worker processes; override with `python worker.py [num_workers]`
+WORKER_PROCESSES = int(os.environ.get("BILLS_WORKER_PROCESSES", "1"))
+
+# Idle polling backs off from MIN to MAX seconds; jobs are drained back-to-back
+MIN_POLL_INTERVAL = float(os.environ.get("BILLS_MIN_POLL_INTERVAL", "0.05"))
+MAX_POLL_INTERVAL = float(os.environ.get("BILLS_MAX_POLL_INTERVAL", "10"))
+
+# Optional routing of jobs to nodes by user_id % NODE_COUNT, so a user's rules stay
+# cached on one host. Jobs left unclaimed for ROUTE_GRACE_SECONDS go to any node.
+NODE_INDEX = int(os.environ.get("BILLS_NODE_INDEX", "0"))
+NODE_COUNT = int(os.environ.get("BILLS_NODE_COUNT", "1"))
+ROUTE_GRACE_SECONDS = 30
+
+# Scheduling: a user runs at most MAX_RUNNING_PER_USER jobs at once, waiting
+# AGING_SECONDS raises a job's priority by one, and jobs due within
+# DEADLINE_URGENT_SECONDS are claimed first
+MAX_RUNNING_PER_USER = int(os.environ.get("BILLS_MAX_RUNNING_PER_USER", "2"))
+AGING_SECONDS = 300
+DEADLINE_URGENT_SECONDS = 60
+
+log = get_logger("worker")
+
+# node_exporter textfile collector directory; unset disables the Prometheus export
+METRICS_DIR = os.environ.get("BILLS_METRICS_DIR")
 
 def notify_systemd():
     try:
@@ -17,93 +52,473 @@ def notify_systemd():
     except Exception:
         pass
 
-db = mysql.connector.connect(
-    host="",
-    user="",
-    password="",
-    database=""
-)
-cursor = db.cursor(dictionary=True)
+# Queue connection and job connection pools, opened per process by connect_queue_db()
+db = None
+cursor = None
+pools = None
+# Lease owner of this process's jobs, set by run_worker()
+WORKER_ID = None
+
+def connect_queue_db():
+    global db, cursor, pools
+    db = connect()
+    cursor = db.cursor(dictionary=True)
+    pools = ConnectionManager()
 
-def fetch_job():
-    cursor.execute("SELECT * FROM date_job WHERE status='pending' ORDER BY created_at ASC LIMIT 1")
-    return cursor.fetchone()
+def reconnect_queue_db():
+    """Re-open the queue connection after the server dropped it"""
+    global cursor
+    db.reconnect(attempts=3, delay=2)
+    cursor = db.cursor(dictionary=True)
 
-def update_status(job_id, status, output=None):
-    cursor.execute("UPDATE date_job SET status=%s, output=%s WHERE id=%s", (status, output, job_id))
+# Errors meaning the queue connection was lost
+QUEUE_ERRORS = (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)
+
+def retry_on_queue(func, *args):
+    """Run a queue update, reconnecting and trying once more if the connection was lost"""
+    try:
+        return func(*args)
+    except QUEUE_ERRORS as e:
+        log.warning("Queue connection lost (%s), reconnecting", e)
+        reconnect_queue_db()
+        return func(*args)
+
+# Commands run in-process; anything else is a shell command
+PYTHON_COMMANDS = ('forecast_all_users', 'generate_all_users', 'generate_bill_dates')
+
+def claim_query(limit, token, owner, shell=False, node_index=NODE_INDEX, node_count=NODE_COUNT):
+    """The UPDATE claiming up to limit pending jobs for fetch_jobs, as (sql, params)"""
+    python_job = "(" + " OR ".join(f"command LIKE '{name}%'" for name in PYTHON_COMMANDS) + ")"
+    where = "status='pending' AND " + (f"NOT {python_job}" if shell else python_job)
+    # Parameters in the order their placeholders appear in the statement
+    params = [AGING_SECONDS]
+    if node_count > 1:
+        where += (" AND (user_id IS NULL OR MOD(user_id, %s) = %s"
+                  " OR created_at < NOW() - INTERVAL %s SECOND)")
+        params += [node_count, node_index, ROUTE_GRACE_SECONDS]
+    params += [MAX_RUNNING_PER_USER, MAX_RUNNING_PER_USER, DEADLINE_URGENT_SECONDS, limit,
+               token, owner, LEASE_SECONDS]
+    sql = f"""UPDATE date_job j
+              JOIN (
+                  SELECT id FROM (
+                      SELECT id, deadline, created_at,
+                             priority + TIMESTAMPDIFF(SECOND, created_at, NOW()) DIV %s AS effective_priority,
+                             ROW_NUMBER() OVER (PARTITION BY COALESCE(user_id, -id)
+                                                ORDER BY priority DESC, created_at) AS user_turn
+                      FROM date_job
+                      WHERE {where}
+                      AND (user_id IS NULL OR user_id NOT IN (
+                          SELECT user_id FROM date_job
+                          WHERE status = 'running' AND user_id IS NOT NULL
+                          GROUP BY user_id HAVING COUNT(*) >= %s))
+                  ) pending
+                  WHERE user_turn <= %s
+                  ORDER BY deadline IS NOT NULL AND deadline < NOW() + INTERVAL %s SECOND DESC,
+                           effective_priority DESC, user_turn, created_at
+                  LIMIT %s
+              ) picked ON picked.id = j.id
+              SET j.status='running', j.claimed_by=%s, j.worker_id=%s,
+                  j.lease_expires_at=NOW() + INTERVAL %s SECOND, j.attempts=j.attempts + 1
+              WHERE j.status='pending'"""
+    return sql, params
+
+def fetch_jobs(limit=1, shell=False):
+    """Claim up to limit pending Python jobs (or shell jobs), by urgency, priority and per-user fairness
+    
+    Jobs whose deadline is within DEADLINE_URGENT_SECONDS go first, then
+    higher priority, where waiting adds one priority level per
+    AGING_SECONDS so batch work still progresses. Within a priority users
+    take turns: every user's first pending job comes before anyone's
+    second (ROW_NUMBER per user_id). Users already running
+    MAX_RUNNING_PER_USER jobs are skipped.
+    
+    The UPDATE tags the rows with a token unique to this claim, so
+    concurrent workers never process the same job, and the claimed rows
+    are read back by that token. Claimed jobs are leased to WORKER_ID (see
+    leases.py). The worker only claims jobs it can start right away, so
+    jobs it can't run yet stay pending for idle peers.
+    """
+    token = uuid.uuid4().hex
+    cursor.execute(*claim_query(limit, token, WORKER_ID, shell))
+    if cursor.rowcount == 0:
+        # End the transaction so the next poll sees newly queued jobs
+        db.commit()
+        return []
+    cursor.execute("SELECT * FROM date_job WHERE claimed_by=%s", (token,))
+    jobs = cursor.fetchall()
     db.commit()
+    return jobs
 
-def process_bill_generation(job_params, test_mode):
+def update_status(job_id, status, output=None, metrics=None):
+    """Record a finished job, unless its lease expired and it was handed to another worker"""
+    cursor.execute("UPDATE date_job SET status=%s, output=%s, metrics=%s, lease_expires_at=NULL "
+                   "WHERE id=%s AND worker_id=%s", (status, output, metrics, job_id, WORKER_ID))
+    if cursor.rowcount == 0:
+        log.warning("Lost the lease on job %s, its result was not recorded", job_id)
+    db.commit()
+
+def job_params(job):
+    """The JSON payload after 'command:' ({} if there is none or it doesn't parse)"""
+    command = job['command']
+    try:
+        params = json.loads(command.split(':', 1)[1]) if ':' in command else {}
+    except ValueError:
+        return {}
+    return params if isinstance(params, dict) else {}
+
+def generation_scope(job):
+    """Return (params, test_mode) for a generate_bill_dates job that can be coalesced, else None"""
+    command = job['command']
+    if not command.startswith('generate_bill_dates'):
+        return None
+    try:
+        params = json.loads(command.split(':', 1)[1]) if ':' in command else {}
+    except ValueError:
+        return None
+    if not isinstance(params, dict):
+        return None
+    # Without a user_id a bill job's user is unknown, so no user-wide job can stand in for it
+    if params.get('bill_id') is not None and 'user_id' not in params:
+        return None
+    params.setdefault('user_id', 1)
+    params.setdefault('num_reps', 42)
+    return params, bool(job['test_mode'])
+
+def covers(scope, other):
+    """True if running the job with scope also does all the work of the job with other"""
+    if scope is None or other is None:
+        return False
+    params, test_mode = scope
+    other_params, other_test_mode = other
+    if test_mode != other_test_mode:
+        return False
+    # A user-wide job covers that user's bill jobs; a bill job only covers the same bill
+    bill_id = params.get('bill_id')
+    if bill_id is not None and other_params.get('bill_id') != bill_id:
+        return False
+    strip = lambda p: {key: value for key, value in p.items() if key != 'bill_id'}
+    return strip(params) == strip(other_params)
+
+def coalesce_jobs(job):
+    """Claim the pending generation jobs made redundant by job and return their ids"""
+    scope = generation_scope(job)
+    if scope is None:
+        return []
+    
+    cursor.execute("SELECT id, command, test_mode FROM date_job "
+                   "WHERE status='pending' AND command LIKE 'generate_bill_dates%'")
+    ids = [other['id'] for other in cursor.fetchall() if covers(scope, generation_scope(other))]
+    if not ids:
+        db.commit()
+        return []
+    
+    # Claim them like fetch_job does; rows another worker took first stay with it
+    marker = f"Coalesced into job {job['id']}"
+    placeholders = ", ".join(["%s"] * len(ids))
+    cursor.execute(f"UPDATE date_job SET status='running', output=%s, worker_id=%s, "
+                   f"lease_expires_at=NOW() + INTERVAL %s SECOND, attempts=attempts + 1 "
+                   f"WHERE status='pending' AND id IN ({placeholders})", [marker, WORKER_ID, LEASE_SECONDS] + ids)
+    cursor.execute(f"SELECT id FROM date_job "
+                   f"WHERE status='running' AND output=%s AND id IN ({placeholders})", [marker] + ids)
+    merged = [row['id'] for row in cursor.fetchall()]
+    db.commit()
+    return merged
+
+def finish_coalesced(job_ids, job_id, status):
+    """Give absorbed jobs the final status of the job that did their work"""
+    placeholders = ", ".join(["%s"] * len(job_ids))
+    cursor.execute(f"UPDATE date_job SET status=%s, output=%s, lease_expires_at=NULL "
+                   f"WHERE worker_id=%s AND id IN ({placeholders})",
+                   [status, f"Coalesced into job {job_id} ({status})", WORKER_ID] + list(job_ids))
+    db.commit()
+
+def generation_span(num_reps, horizon_days):
+    return f"a {horizon_days}-day horizon" if horizon_days else f"{num_reps} repetitions"
+
+def process_bill_generation(job_params, test_mode, metrics):
     """Process bill generation job with Python code instead of shell command"""
     try:
         # Parse job parameters
         params = json.loads(job_params) if job_params else {}
         num_reps = params.get('num_reps', 42)
         user_id = params.get('user_id', 1)
+        bill_id = params.get('bill_id')
+        # Generate every bill up to today + horizon_days instead of num_reps occurrences
+        horizon_days = params.get('horizon_days')
+        span = generation_span(num_reps, horizon_days)
+        # 0 falls back to per-row check_date_exists + insert
+        batch_size = params.get('batch_size', DEFAULT_CHUNK_SIZE)
+        # Overlap reads, date computation and writes on separate connections
+        pipelined = params.get('pipelined', False)
         
-        if test_mode:
-            db = mysql.connector.connect(
-                host="",
-                user="",
-                password="",
-                database=""
-            )
-            cursor = db.cursor(dictionary=True)
-        else:
-            db = mysql.connector.connect(
-                host="",
-                user="",
-                password="",
-                database=""
-            )
-            cursor = db.cursor(dictionary=True)
-
-        # Create Bills instance
-        bill = Bills(num_reps, db)
+        with pools.connection(test_mode) as db:
+            # Create Bills instance
+            bill = Bills(num_reps, InstrumentedConnection(db, metrics), batch_size, metrics, horizon_days)
+            
+            # Execute the bill generation process, only touching the rows in scope
+            with metrics.phase("set_pay_period"):
+                bill.set_pay_period()
+            if bill_id is not None:
+                with metrics.phase("delete_old_dates"):
+                    bill.delete_old_dates(bill_id=bill_id)
+                bill.generate_bill_dates_by_bill_id(bill_id)
+                result = f"Bill generation completed successfully for bill {bill_id} with {span}"
+            else:
+                with metrics.phase("delete_old_dates"):
+                    bill.delete_old_dates(user_id=user_id)
+                if pipelined:
+                    with pools.connection(test_mode) as read_db:
+                        bill.generate_pipelined(InstrumentedConnection(read_db, metrics), user_id)
+                else:
+                    bill.generate_bill_dates_by_user_id(user_id)
+                result = f"Bill generation completed successfully for user {user_id} with {span}"
+        return f"{result} ({metrics.rows_inserted} rows inserted, {metrics.duplicates_skipped} duplicates skipped)"
         
-        # Execute the bill generation process
-        bill.delete_old_dates()
-        bill.set_pay_period()
-        bill.generate_bill_dates_by_user_id(user_id)
+    except Exception as e:
+        raise Exception(f"Bill generation failed: {str(e)}")
+
+def process_all_users_generation(job_params, test_mode, metrics):
+    """Regenerate bill dates for every user in a single pass over vnd_bills"""
+    try:
+        params = json.loads(job_params) if job_params else {}
+        num_reps = params.get('num_reps', 42)
+        horizon_days = params.get('horizon_days')
+        span = generation_span(num_reps, horizon_days)
+        batch_size = params.get('batch_size', DEFAULT_CHUNK_SIZE)
+        pipelined = params.get('pipelined', False)
+        # Write every date to a TSV file and LOAD DATA it instead of INSERT batches
+        bulk_load = params.get('bulk_load', False)
         
-        return f"Bill generation completed successfully for user {user_id} with {num_reps} repetitions"
+        # Second connection keeps the unbuffered vnd_bills stream open while db writes
+        with pools.connection(test_mode) as db, pools.connection(test_mode) as stream_db:
+            bill = Bills(num_reps, InstrumentedConnection(db, metrics), batch_size, metrics, horizon_days)
+            with metrics.phase("delete_old_dates"):
+                bill.delete_old_dates()
+            with metrics.phase("set_pay_period"):
+                bill.set_pay_period()
+            stream_db = InstrumentedConnection(stream_db, metrics)
+            if bulk_load:
+                num_users, inserted = bulk_load_all_users(bill, stream_db, metrics)
+                return (f"Bill generation completed successfully for {num_users} users with {span} "
+                        f"({inserted} rows bulk loaded)")
+            if pipelined:
+                num_users = bill.generate_pipelined(stream_db)
+            else:
+                num_users = bill.generate_all_users(stream_db)
+        
+        return (f"Bill generation completed successfully for {num_users} users with {span} "
+                f"({metrics.rows_inserted} rows inserted, {metrics.duplicates_skipped} duplicates skipped)")
         
     except Exception as e:
         raise Exception(f"Bill generation failed: {str(e)}")
 
-def execute_job(job, test_mode):
-    """Execute a job - either as shell command or Python function"""
+def bulk_load_all_users(bill, stream_db, metrics):
+    """Export every user's dates to a TSV file, then LOAD DATA it in one statement"""
+    path = bulk_file_path(f"bill_dates_{os.getpid()}.tsv")
+    try:
+        with BillDateFile(path) as out:
+            num_users = bill.generate_to_file(stream_db, out)
+        with metrics.phase("load_data"):
+            inserted = load_bill_dates_file(bill.db, path)
+        metrics.rows_inserted += inserted
+        metrics.duplicates_skipped += out.rows_written - inserted
+        with metrics.phase("commit"):
+            bump_version(bill.cursor, ALL_USERS)
+            bill.db.commit()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return num_users, inserted
+
+# Users whose forecasts are written per INSERT round-trip
+FORECAST_USERS_PER_BATCH = 200
+
+def process_forecast(job_params, test_mode, metrics):
+    """Rebuild vnd_bill_forecast for every user in a single pass over vnd_bills"""
+    try:
+        params = json.loads(job_params) if job_params else {}
+        periods = params.get('periods', 24)
+        if isinstance(periods, bool) or not isinstance(periods, int) or periods < 1:
+            raise ValueError(f"periods must be a positive integer, got {periods!r}")
+        
+        with pools.connection(test_mode) as db, pools.connection(test_mode) as stream_db:
+            bill = Bills(0, InstrumentedConnection(db, metrics), metrics=metrics)
+            with metrics.phase("set_pay_period"):
+                bill.set_pay_period()
+            with metrics.phase("delete_old_forecast"):
+                bill.cursor.execute("DELETE FROM vnd_bill_forecast")
+            
+            num_users = 0
+            batch = []
+            with metrics.phase("generate"):
+                for user_forecast in bill.forecast_all_users(InstrumentedConnection(stream_db, metrics), periods):
+                    batch.append(user_forecast)
+                    num_users += 1
+                    if len(batch) >= FORECAST_USERS_PER_BATCH:
+                        bill.save_forecasts(batch)
+                        batch = []
+                bill.save_forecasts(batch)
+            with metrics.phase("commit"):
+                bill.db.commit()
+        
+        return f"Forecast completed successfully for {num_users} users over {periods} pay periods"
+        
+    except Exception as e:
+        raise Exception(f"Forecast failed: {str(e)}")
+
+def execute_job(job, test_mode, metrics):
+    """Execute a Python job; shell commands go to the ShellJobRunner"""
     command = job['command']
     
     # Check if this is a bill generation command
-    if command.startswith('generate_bill_dates'):
+    if command.startswith('forecast_all_users'):
+        # Format: forecast_all_users:{"periods": 24}
+        params_str = command.split(':', 1)[1] if ':' in command else '{}'
+        return process_forecast(params_str, test_mode, metrics)
+    elif command.startswith('generate_all_users'):
+        # Format: generate_all_users:{"num_reps": 42}
+        if ':' in command:
+            _, params_str = command.split(':', 1)
+            return process_all_users_generation(params_str, test_mode, metrics)
+        else:
+            return process_all_users_generation('{}', test_mode, metrics)
+    elif command.startswith('generate_bill_dates'):
         # Extract parameters if any (format: generate_bill_dates:{"user_id": 1, "num_reps": 42})
         if ':' in command:
             _, params_str = command.split(':', 1)
-            return process_bill_generation(params_str, test_mode)
+            return process_bill_generation(params_str, test_mode, metrics)
         else:
-            return process_bill_generation('{}', test_mode)
+            return process_bill_generation('{}', test_mode, metrics)
     else:
-        # Execute as shell command (original behavior)
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=300)
-        output = result.stdout + "\n" + result.stderr
-        if result.returncode != 0:
-            raise Exception(output)
-        return output
+        raise Exception(f"Not a Python job: {command}")
 
-while True:
+def finish_job(exporter, job_id, status, output, metrics):
+    update_status(job_id, status, output, metrics.to_json())
+    if exporter:
+        exporter.observe(metrics, status)
+        exporter.write()
 
-    notify_systemd()
+def run_worker(watchdog=True, wakeup_socket=None, worker_index=0):
+    """Process jobs forever; pool members leave the watchdog to the supervisor
+    
+    While jobs are pending they run back-to-back. When the queue is empty the
+    poll interval doubles up to MAX_POLL_INTERVAL, and a signal on the wake-up
+    socket cuts the wait short. Shell jobs run in the background on a
+    ShellJobRunner. Each round claims one Python job plus a shell job per
+    free ShellJobRunner slot, nothing the worker can't start right away.
+    """
+    global WORKER_ID
+    setup_logging()
+    WORKER_ID = worker_id()
+    log.info("Worker %s started as %s", worker_index, WORKER_ID)
+    connect_queue_db()
+    # Keeps this worker's leases alive and requeues jobs of dead workers, outside the job pool
+    start_heartbeat(connect, WORKER_ID)
+    # Output streaming and cancel checks use the queue database
+    shell_jobs = ShellJobRunner(lambda: pools.connection(False))
+    exporter = None
+    if METRICS_DIR:
+        exporter = PrometheusTextfile(os.path.join(METRICS_DIR, f"bills_worker_{worker_index}.prom"),
+                                      {"worker": worker_index})
+    if worker_index == 0:
+        start_maintenance(lambda: pools.connection(False))
+    poll_interval = MIN_POLL_INTERVAL
+    while True:
+        
+        if watchdog:
+            notify_systemd()
+        
+        for shell_job, status, output, metrics in shell_jobs.finished():
+            retry_on_queue(finish_job, exporter, shell_job['id'], status, output, metrics)
+        
+        job = None
+        started_shell_jobs = False
+        try:
+            if shell_jobs.free_slots():
+                for shell_job in fetch_jobs(shell_jobs.free_slots(), shell=True):
+                    shell_jobs.submit(shell_job)
+                    started_shell_jobs = True
+            jobs = fetch_jobs(1)
+            job = jobs[0] if jobs else None
+        except QUEUE_ERRORS as e:
+            log.warning("Queue connection lost (%s), reconnecting", e)
+            reconnect_queue_db()
+        
+        if job:
+            try:
+                merged = coalesce_jobs(job)
+            except QUEUE_ERRORS as e:
+                # The uncommitted claim of the other jobs is rolled back; run this one on its own
+                log.warning("Queue connection lost while coalescing job %s (%s), reconnecting", job['id'], e)
+                reconnect_queue_db()
+                merged = []
+            metrics = JobMetrics()
+            profile = None
+            params = job_params(job)
+            try:
+                # "trace": true logs every bill of this job at DEBUG level
+                with job_trace(params.get('trace')):
+                    if params.get('profile'):
+                        with profiled(job['id'], metrics) as profile:
+                            output = execute_job(job, job['test_mode'], metrics)
+                    else:
+                        output = execute_job(job, job['test_mode'], metrics)
+                status = 'done'
+            except Exception as e:
+                output = str(e)
+                status = 'error'
+            metrics.finish()
+            log.info("Job %s finished: %s", job['id'], status,
+                     extra={"job_id": job['id'], "status": status, "wall_seconds": metrics.wall_seconds})
+            if profile:
+                output = f"{output}\n{profile}"
+            if merged:
+                retry_on_queue(finish_coalesced, merged, job['id'], status)
+                output = f"{output}\nCoalesced {len(merged)} pending jobs: {', '.join(map(str, merged))}"
+            retry_on_queue(finish_job, exporter, job['id'], status, output, metrics)
+            poll_interval = MIN_POLL_INTERVAL
+            continue
+        if started_shell_jobs:
+            poll_interval = MIN_POLL_INTERVAL
+            continue
+        
+        # Come back often enough to record finished shell jobs promptly
+        if shell_jobs.running:
+            poll_interval = min(poll_interval, FLUSH_INTERVAL)
+        if wait_for_wakeup(wakeup_socket, poll_interval):
+            poll_interval = MIN_POLL_INTERVAL
+        else:
+            poll_interval = min(poll_interval * 2, MAX_POLL_INTERVAL)
 
-    job = fetch_job()
+def run_pool(num_workers):
+    """Supervise num_workers worker processes, restarting any that exit
+    
+    The systemd watchdog is only notified while the supervisor is running
+    its checks, so a hung supervisor still gets the whole pool restarted.
+    """
+    # Bound before forking so every worker waits on the same socket
+    wakeup_socket = open_wakeup_socket()
+    processes = {}
+    while True:
+        for index in range(num_workers):
+            process = processes.get(index)
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                log.warning("Worker %s exited with code %s, restarting", index, process.exitcode)
+            process = multiprocessing.Process(target=run_worker, args=(False, wakeup_socket, index),
+                                              daemon=True)
+            process.start()
+            processes[index] = process
+        
+        notify_systemd()
+        time.sleep(2)
 
-    if job:
-        update_status(job['id'], 'running')
-        try:
-            output = execute_job(job, job['test_mode'])
-            status = 'done'
-        except Exception as e:
-            output = str(e)
-            status = 'error'
-        update_status(job['id'], status, output)
-    time.sleep(2)
\ No newline at end of file
+if __name__ == "__main__":
+    setup_logging()
+    num_workers = int(sys.argv[1]) if len(sys.argv) > 1 else WORKER_PROCESSES
+    if num_workers > 1:
+        log.info("Starting pool of %s workers", num_workers)
+        run_pool(num_workers)
+    else:
+        run_worker(wakeup_socket=open_wakeup_socket())